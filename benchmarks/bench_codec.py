@@ -0,0 +1,89 @@
+# benchmarks/bench_codec.py
+#
+# Micro-benchmark for irp_codec against the old double json.dumps envelope.
+# 'pre-canonical' rows encode payloads that are already canonical (the common case for
+# format_invoice_json), which the canonical pass walks without sorting or rebuilding sections.
+# Usage: python benchmarks/bench_codec.py [invoice_count]   (default 10000)
+
+import os
+import sys
+import json
+import time
+import random
+import base64
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import irp_codec
+
+
+def sample_payload(i, rng):
+    """Invoice shaped like format_invoice_json output, with realistic float noise and empty optionals."""
+    qty = rng.randint(1, 50) * 1.0
+    price = round(rng.uniform(10, 5000), 2)
+    ass = qty * price
+    igst = ass * 0.18
+    return {
+        "Version": "1.1",
+        "TranDtls": {"TaxSch": "GST", "SupTyp": "B2B", "RegRev": None, "IgstOnIntra": ""},
+        "DocDtls": {"Typ": "INV", "No": f"INV/{i:06d}", "Dt": "01/04/2025"},
+        "SellerDtls": {"Gstin": "29AAACA1234A1Z5", "LglNm": "Seller Pvt Ltd", "TrdNm": "", "Addr1": "1 MG Road",
+                       "Addr2": "", "Loc": "Bengaluru", "Pin": 560001, "Stcd": "29", "Ph": None, "Em": None},
+        "BuyerDtls": {"Gstin": "07AAACB5678B1Z2", "LglNm": f"Buyer {i % 300}", "TrdNm": "", "Pos": "07",
+                      "Addr1": "22 Connaught Place", "Addr2": "", "Loc": "New Delhi", "Pin": 110001, "Stcd": "07",
+                      "Ph": None, "Em": ""},
+        "ItemList": [{
+            "SlNo": str(n + 1), "PrdDesc": "Product", "IsServc": "N", "HsnCd": "8471", "Qty": qty, "Unit": "NOS",
+            "UnitPrice": price, "TotAmt": ass, "Discount": 0.0, "PreTaxVal": ass, "AssAmt": ass, "GstRt": 18.0,
+            "IgstAmt": igst, "CgstAmt": 0.0, "SgstAmt": 0.0, "CesAmt": None, "TotItemVal": ass + igst,
+            "BchDtls": {}, "AttribDtls": [],
+        } for n in range(rng.randint(1, 5))],
+        "ValDtls": {"AssVal": ass, "CgstVal": 0.0, "SgstVal": 0.0, "IgstVal": igst, "TotInvVal": ass + igst,
+                    "TotInvValFc": None},
+    }
+
+
+def sample_response(i, rng):
+    qr = base64.b64encode(rng.randbytes(1200)).decode()
+    return json.dumps({"Status": 1, "Data": {"AckNo": 112010000000000 + i, "AckDt": "2025-04-01 10:00:00",
+                                             "Irn": f"{i:064x}", "SignedInvoice": qr * 2, "SignedQRCode": qr,
+                                             "Status": "ACT"}})
+
+
+def legacy_encode(payload):
+    return json.dumps({"Data": json.dumps(payload)})
+
+
+def timed(fn, items):
+    start = time.perf_counter()
+    out = [fn(x) for x in items]
+    return time.perf_counter() - start, out
+
+
+def main(count):
+    rng = random.Random(42)
+    payloads = [sample_payload(i, rng) for i in range(count)]
+    responses = [sample_response(i, rng) for i in range(count)]
+
+    rows = []
+    secs, encoded = timed(legacy_encode, payloads)
+    dsecs, _ = timed(json.loads, responses)
+    rows.append(("legacy json.dumps x2", secs, sum(len(e.encode()) for e in encoded) / count, dsecs))
+
+    # Already-canonical input: the canonical pass still runs, but never sorts
+    prebuilt = [irp_codec.canonicalize(p) for p in payloads]
+    for backend in irp_codec.BACKENDS:
+        irp_codec.use_backend(backend)
+        secs, encoded = timed(lambda p: irp_codec.encode_envelope(irp_codec.encode_payload(p)), payloads)
+        dsecs, _ = timed(irp_codec.loads, responses)
+        rows.append((f"irp_codec[{backend}]", secs, sum(len(e.encode()) for e in encoded) / count, dsecs))
+        secs, encoded = timed(lambda p: irp_codec.encode_envelope(irp_codec.encode_payload(p)), prebuilt)
+        rows.append(("  pre-canonical", secs, sum(len(e.encode()) for e in encoded) / count, dsecs))
+
+    print(f"{count} invoices")
+    print(f"{'codec':<24}{'encode s':>10}{'bytes/inv':>12}{'decode s':>10}")
+    for name, secs, size, dsecs in rows:
+        print(f"{name:<24}{secs:>10.3f}{size:>12.0f}{dsecs:>10.3f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,226 @@
+# benchmarks/bench_pipeline.py
+#
+# Micro-benchmarks for the invoice hot paths on synthetic Tally exports (synthetic_tally.py):
+#   xml_parse       xmltodict.parse + extract_vouchers   (fetch_pending_invoices parsing)
+#   parse_vouchers  parse_voucher_data per voucher
+#   format_json     irn_generator.format_invoice_json per invoice
+#   validate        lookup_gstin + validate_invoice_data_for_irn per payload (as the shard worker does)
+# The corpus is streamed as successive exports of --batch-size vouchers (one fetch each), so memory
+# is bounded by the batch and 1M-voucher runs are feasible. Stage times are summed over the batches
+# (best of --repeat); peak MB is the largest per-batch peak, from one more pass under tracemalloc.
+#
+# Every run is appended to benchmarks/results/history.jsonl and compared against the previous
+# run with the same sizes, or a named baseline:
+#   python benchmarks/bench_pipeline.py --sizes 100,1000,10000 --save-baseline main
+#   python benchmarks/bench_pipeline.py --sizes 100,1000,10000 --compare main --fail-on-regression
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import xmltodict
+import irp_codec
+import gstin_lookup
+import synthetic_tally
+from tally_connector import extract_vouchers, parse_voucher_data
+from gstin_lookup import lookup_gstin
+from validator import validate_invoice_data_for_irn
+
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+HISTORY_PATH = os.path.join(RESULTS_DIR, 'history.jsonl')
+BASELINE_DIR = os.path.join(RESULTS_DIR, 'baselines')
+DEFAULT_BATCH_SIZE = 10000
+
+
+def payload_from_invoice(invoice):
+    """Minimal IRP-shaped payload for the validate stage when format_invoice_json is unavailable."""
+    total = invoice['total_amount']
+    return {
+        "Version": "1.1",
+        "TranDtls": {"TaxSch": "GST", "SupTyp": "B2B"},
+        "DocDtls": {"Typ": "INV", "No": invoice['voucher_number'], "Dt": "01/04/2025"},
+        "SellerDtls": {"Gstin": "29AAACA1234A1Z5", "LglNm": "Seller"},
+        "BuyerDtls": {"Gstin": invoice['party_gstin'], "LglNm": invoice['party_name'], "Pos": invoice['party_gstin'][:2]},
+        "ItemList": [{"SlNo": "1", "IsServc": "N", "HsnCd": "8471", "GstRt": 18.0, "TotItemVal": total}],
+        "ValDtls": {"AssVal": invoice['taxable_amount'], "TotInvVal": total},
+    }
+
+
+def _seed_gstin_cache(seed):
+    """Make every buyer a warm in-memory hit, as after fetch_pending_invoices' prefetch."""
+    for _, gstin, state_code, _ in synthetic_tally.build_customers(seed):
+        gstin_lookup._remember({'gstin': gstin, 'valid': True, 'reason': '', 'fetched_at': time.time(),
+                                'details': {'LglNm': 'Buyer', 'Addr1': 'Addr', 'Loc': 'City', 'Pin': 560001,
+                                            'Stcd': state_code}})
+
+
+def _load_formatter():
+    try:
+        from irn_generator import format_invoice_json
+        return format_invoice_json, None
+    except Exception as e:  # irn_generator needs IRP settings/credentials at import time
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _run_batches(count, seed, batch_size, format_invoice_json, trace=False):
+    """
+    One pass over the corpus. Returns {stage: total seconds}, or with trace=True
+    {stage: largest per-batch peak bytes}. Generating the XML is not part of any stage.
+    """
+    totals = {}
+
+    def stage(name, fn, arg):
+        if trace:
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            out = fn(arg)
+            totals[name] = max(totals.get(name, 0), tracemalloc.get_traced_memory()[1] - base)
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            out = fn(arg)
+            totals[name] = totals.get(name, 0.0) + time.perf_counter() - start
+        return out
+
+    for xml_text in synthetic_tally.iter_export_batches(count, batch_size, seed):
+        vouchers = stage('xml_parse', lambda text: extract_vouchers(xmltodict.parse(text)), xml_text)
+        del xml_text
+        invoices = stage('parse_vouchers', lambda vs: [p for p in map(parse_voucher_data, vs) if p], vouchers)
+        del vouchers
+        if format_invoice_json:
+            envelopes = stage('format_json', lambda invs: [format_invoice_json(i) for i in invs], invoices)
+            payloads = [irp_codec.decode_envelope(e) for e in envelopes]
+            del envelopes
+        else:
+            payloads = [payload_from_invoice(i) for i in invoices]
+        stage('validate', lambda items: [validate_invoice_data_for_irn(p, lookup_gstin(i['party_gstin']))
+                                         for p, i in items], list(zip(payloads, invoices)))
+    return totals
+
+
+def run_size(count, seed, repeat, batch_size=DEFAULT_BATCH_SIZE):
+    format_invoice_json, reason = _load_formatter()
+    _seed_gstin_cache(seed)
+
+    seconds = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            for name, secs in _run_batches(count, seed, batch_size, format_invoice_json).items():
+                seconds[name] = min(seconds.get(name, secs), secs)
+        peaks = _run_batches(count, seed, batch_size, format_invoice_json, trace=True)
+
+    stages = {}
+    for name in ('xml_parse', 'parse_vouchers', 'format_json', 'validate'):
+        if name not in seconds:
+            stages[name] = {'skipped': reason}
+            continue
+        stages[name] = {'seconds': round(seconds[name], 6), 'us_per_voucher': round(seconds[name] / count * 1e6, 3),
+                        'peak_mb': round(peaks[name] / 2**20, 3)}
+    return stages
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ''
+
+
+def _load_reference(compare, sizes):
+    """Named baseline, or the latest history entry that covered the same sizes."""
+    if compare:
+        with open(os.path.join(BASELINE_DIR, f"{compare}.json"), encoding='utf-8') as f:
+            return json.load(f)
+    if not os.path.exists(HISTORY_PATH):
+        return None
+    latest = None
+    with open(HISTORY_PATH, encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if sorted(entry['results']) == sorted(sizes):
+                latest = entry
+    return latest
+
+
+def _report(run, reference, threshold):
+    """Print the results table; returns the list of regressions beyond threshold (fraction)."""
+    regressions = []
+    ref_results = (reference or {}).get('results', {})
+    label = f" (vs {reference.get('name') or reference.get('git') or reference['timestamp']})" if reference else ""
+    print(f"{'vouchers':>9} {'stage':<15}{'seconds':>10}{'us/vch':>10}{'peak MB':>10}{'d time':>9}{'d mem':>9}{label}")
+    for size, stages in run['results'].items():
+        for stage, r in stages.items():
+            if 'skipped' in r:
+                print(f"{size:>9} {stage:<15}  skipped ({r['skipped']})")
+                continue
+            ref = ref_results.get(size, {}).get(stage, {})
+            deltas = []
+            for key in ('seconds', 'peak_mb'):
+                if ref.get(key):
+                    change = (r[key] - ref[key]) / ref[key]
+                    deltas.append(f"{change:+.1%}")
+                    if change > threshold:
+                        regressions.append(f"{size} vouchers / {stage}: {key} {change:+.1%}")
+                else:
+                    deltas.append("")
+            print(f"{size:>9} {stage:<15}{r['seconds']:>10.4f}{r['us_per_voucher']:>10.2f}{r['peak_mb']:>10.2f}"
+                  f"{deltas[0]:>9}{deltas[1]:>9}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark invoice parsing/formatting/validation stages.")
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help="comma-separated voucher counts (e.g. 100,1000,10000,100000,1000000)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="timing repetitions per stage (best is kept)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="vouchers per synthetic export (one Tally fetch); bounds memory")
+    parser.add_argument('--save-baseline', metavar='NAME', help="also store this run as a named baseline")
+    parser.add_argument('--compare', metavar='NAME', help="compare against a named baseline instead of the last run")
+    parser.add_argument('--threshold', type=float, default=0.10, help="regression threshold as a fraction")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit 1 if any stage regressed")
+    args = parser.parse_args()
+
+    sizes = [str(int(s)) for s in args.sizes.split(',') if s.strip()]
+    reference = _load_reference(args.compare, sizes)
+
+    run = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'git': _git_revision(), 'name': args.save_baseline,
+           'python': platform.python_version(), 'machine': platform.machine(), 'seed': args.seed,
+           'json_backend': irp_codec.BACKEND, 'batch_size': args.batch_size, 'results': {}}
+    for size in sizes:
+        print(f"Running {size} vouchers...")
+        run['results'][size] = run_size(int(size), args.seed, max(1, args.repeat), max(1, args.batch_size))
+
+    regressions = _report(run, reference, args.threshold)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(HISTORY_PATH, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved baseline '{args.save_baseline}'")
+
+    if regressions:
+        print("Regressions over threshold:")
+        for line in regressions:
+            print(f"  {line}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# benchmarks/synthetic_tally.py
+#
+# Deterministic generator of Tally XML exports shaped like the responses tally_connector parses.
+# The same (count, seed) always yields byte-identical output. The corpus mixes:
+#   - multi-line vouchers (party + tax ledgers, several inventory lines)
+#   - single ledger entry / single inventory entry vouchers, which xmltodict returns as a
+#     dict instead of a list (the "not-a-list" quirk parse_voucher_data guards against)
+#   - ledger-only (service) vouchers with no inventory entries
+#   - intra-state (CGST + SGST) and inter-state (IGST) supplies
+#   - a small pool of repeat customers, as in a real company (some names need XML escaping)
+# Elements carry Tally's TYPE="..." attributes and vouchers the REMOTEID/VCHKEY/VCHTYPE/ACTION/OBJVIEW
+# attributes, so xmltodict returns the same {'@TYPE': ..., '#text': ...} leaves as a real export;
+# Number fields are space-padded the way Tally writes them.
+#
+# Usage: python benchmarks/synthetic_tally.py <count> <output.xml> [--seed N] [--shape collection|report]
+
+import random
+import argparse
+from xml.sax.saxutils import escape, quoteattr
+
+SELLER_STATE = ("29", "Karnataka")
+STATES = [("29", "Karnataka"), ("07", "Delhi"), ("27", "Maharashtra"), ("33", "Tamil Nadu"),
+          ("09", "Uttar Pradesh"), ("24", "Gujarat"), ("19", "West Bengal"), ("36", "Telangana")]
+GST_RATES = [5, 12, 18, 28]
+CUSTOMER_POOL_SIZE = 300
+UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CHECK_CHARS = "0123456789" + UPPER
+
+# Mix of voucher shapes (cumulative thresholds on rng.random())
+SINGLE_LEDGER_SHARE = 0.08   # party ledger only (exempt supply) -> ALLLEDGERENTRIES.LIST is a dict
+SERVICE_SHARE = 0.22         # no inventory lines; sales ledger carries the taxable value
+SINGLE_ITEM_SHARE = 0.50     # exactly one inventory line -> ALLINVENTORYENTRIES.LIST is a dict
+
+
+def _gstin(rng, state_code):
+    pan = "".join(rng.choice(UPPER) for _ in range(5)) + f"{rng.randint(0, 9999):04d}" + rng.choice(UPPER)
+    return f"{state_code}{pan}{rng.choice('123456789')}Z{rng.choice(CHECK_CHARS)}"
+
+
+def build_customers(seed=0, size=CUSTOMER_POOL_SIZE):
+    """Customer master shared by every voucher: (name, gstin, state_code, state_name)."""
+    rng = random.Random(f"customers-{seed}")
+    customers = []
+    for i in range(size):
+        code, state = rng.choice(STATES)
+        suffix = "& Sons Pvt Ltd" if i % 7 == 0 else "Pvt Ltd"
+        customers.append((f"Customer {i:04d} {suffix}", _gstin(rng, code), code, state))
+    return customers
+
+
+def _company_guid(seed):
+    rng = random.Random(f"company-{seed}")
+    h = "".join(rng.choice("0123456789abcdef") for _ in range(32))
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _leaf(tag, value, type_):
+    return f'<{tag} TYPE="{type_}">{escape(value)}</{tag}>'
+
+
+def _ledger(name, amount, is_party=False):
+    return ("<ALLLEDGERENTRIES.LIST>"
+            + _leaf("LEDGERNAME", name, "String")
+            + _leaf("ISPARTYLEDGER", "Yes" if is_party else "No", "Logical")
+            + _leaf("AMOUNT", f"{amount:.2f}", "Amount") +
+            "</ALLLEDGERENTRIES.LIST>")
+
+
+def _voucher(i, rng, customers, guid):
+    name, gstin, state_code, state = customers[int(rng.expovariate(1 / 60)) % len(customers)]  # Skewed towards regulars
+    intra = state_code == SELLER_STATE[0]
+    rate = rng.choice(GST_RATES)
+    shape = rng.random()
+    day = 1 + i % 28
+
+    inventory = []
+    if shape < SINGLE_LEDGER_SHARE:
+        rate = 0
+        lines = 1
+    elif shape < SINGLE_LEDGER_SHARE + SERVICE_SHARE:
+        lines = 0
+    elif shape < SINGLE_LEDGER_SHARE + SERVICE_SHARE + SINGLE_ITEM_SHARE:
+        lines = 1
+    else:
+        lines = rng.randint(2, 6)
+
+    taxable = 0.0
+    for _ in range(max(lines, 1)):
+        qty = rng.randint(1, 100)
+        price = round(rng.uniform(5, 2500), 2)
+        value = round(qty * price, 2)
+        taxable += value
+        if lines:
+            inventory.append("<ALLINVENTORYENTRIES.LIST>"
+                             + _leaf("STOCKITEMNAME", f"Item {rng.randint(1, 2000):04d}", "String")
+                             + _leaf("AMOUNT", f"{value:.2f}", "Amount") +
+                             "</ALLINVENTORYENTRIES.LIST>")
+    taxable = round(taxable, 2)
+    tax = round(taxable * rate / 100, 2)
+    total = round(taxable + tax, 2)
+
+    ledgers = [_ledger(name, -total, is_party=True)]
+    if shape >= SINGLE_LEDGER_SHARE:
+        if not lines:
+            ledgers.append(_ledger(f"Service Income {rate}%", taxable))
+        if intra:
+            half = round(tax / 2, 2)
+            ledgers.append(_ledger(f"Output CGST {rate / 2:g}%", half))
+            ledgers.append(_ledger(f"Output SGST {rate / 2:g}%", round(tax - half, 2)))
+        else:
+            ledgers.append(_ledger(f"Output IGST {rate}%", tax))
+
+    master_id = 100000 + i
+    view = "Invoice Voucher View" if lines else "Accounting Voucher View"
+    return (f'<VOUCHER REMOTEID="{guid}-{master_id:08x}" VCHKEY="{guid}-0000b{day:03x}:{i * 8:08x}" '
+            f'VCHTYPE="Sales" ACTION="Create" OBJVIEW={quoteattr(view)}>'
+            + _leaf("MASTERID", f" {master_id}", "Number")  # Tally right-aligns numbers with spaces
+            + _leaf("VOUCHERNUMBER", f"INV/{i + 1:07d}", "String")
+            + _leaf("DATE", f"202504{day:02d}", "Date")
+            + _leaf("PARTYLEDGERNAME", name, "String")
+            + _leaf("PARTYGSTIN", gstin, "String")
+            + _leaf("STATENAME", state, "String")
+            + "".join(ledgers) + "".join(inventory) +
+            "</VOUCHER>")
+
+
+def _envelope(shape):
+    """(opening, closing) markup around the voucher elements."""
+    head = "<ENVELOPE><HEADER><VERSION>1</VERSION><STATUS>1</STATUS></HEADER><BODY><DESC></DESC><DATA>"
+    if shape == "collection":
+        return head + "<COLLECTION>", "</COLLECTION></DATA></BODY></ENVELOPE>"
+    return head, "</DATA></BODY></ENVELOPE>"
+
+
+def iter_vouchers(count, seed=0, shape="collection"):
+    """Voucher elements one at a time (wrapped in TALLYMESSAGE for the report shape)."""
+    rng = random.Random(seed)
+    customers = build_customers(seed)
+    guid = _company_guid(seed)
+    for i in range(count):
+        voucher = _voucher(i, rng, customers, guid)
+        yield voucher if shape == "collection" else f"<TALLYMESSAGE>{voucher}</TALLYMESSAGE>"
+
+
+def iter_export_chunks(count, seed=0, shape="collection"):
+    """
+    Yield the export as string chunks (one per voucher) so very large corpora can be streamed to disk.
+    shape="collection" matches the inline TDL collection export; "report" the older TALLYMESSAGE layout.
+    """
+    head, tail = _envelope(shape)
+    yield head
+    yield from iter_vouchers(count, seed, shape)
+    yield tail
+
+
+def iter_export_batches(count, batch_size, seed=0, shape="collection"):
+    """
+    The same corpus split into complete exports of at most batch_size vouchers, as successive
+    fetches would return it. Only one batch is in memory at a time.
+    """
+    head, tail = _envelope(shape)
+    batch = []
+    for voucher in iter_vouchers(count, seed, shape):
+        batch.append(voucher)
+        if len(batch) == batch_size:
+            yield head + "".join(batch) + tail
+            batch = []
+    if batch:
+        yield head + "".join(batch) + tail
+
+
+def generate_export(count, seed=0, shape="collection"):
+    """Whole export as one string (what fetch_pending_invoices receives as response.text)."""
+    return "".join(iter_export_chunks(count, seed, shape))
+
+
+def write_export(path, count, seed=0, shape="collection"):
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in iter_export_chunks(count, seed, shape):
+            f.write(chunk)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Tally voucher export.")
+    parser.add_argument("count", type=int)
+    parser.add_argument("output")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shape", choices=("collection", "report"), default="collection")
+    args = parser.parse_args()
+    write_export(args.output, args.count, args.seed, args.shape)
+    print(f"Wrote {args.count} vouchers to {args.output}")
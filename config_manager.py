@@ -4,8 +4,61 @@ import os
 import configparser
 from utils import get_current_time_utc
 
+ENV_PATH = os.path.join(os.path.dirname(__file__), '.env')
+
+# --- IRP base URLs (override with IRP_SANDBOX_URL / IRP_PRODUCTION_URL, e.g. for a GSP or a local stub) ---
+IRP_SANDBOX_URL = os.environ.get('IRP_SANDBOX_URL', 'https://einv-apisandbox.nic.in')
+IRP_PRODUCTION_URL = os.environ.get('IRP_PRODUCTION_URL', 'https://einvapi.nic.in')
+
+# Used for any [IRP_API] key missing from config.ini
+IRP_API_DEFAULTS = {
+    'Mode': 'SANDBOX',
+    'AuthPath': '/ewaybillapi/v1.04/auth',
+    'GeneratePath': '/ewaybillapi/v1.04/invoice',
+    'GetGstinDetailsPath': '/ewaybillapi/v1.04/master/gstin',
+}
+
+def load_env(path=ENV_PATH):
+    """Load KEY=VALUE lines from .env into os.environ. Variables already set in the environment win."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as env_file:
+        for line in env_file:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+                value = value[1:-1]
+            os.environ.setdefault(key.strip(), value)
+
+load_env()
+
+def get_api_credentials():
+    """IRP API (username, password) from the environment / .env; None for anything not set."""
+    return os.environ.get('IRP_API_USERNAME') or None, os.environ.get('IRP_API_PASSWORD') or None
+
+def _apply_irp_defaults(config):
+    """Fill [IRP_API] from defaults; USER_GSTIN / IRP_MODE from the environment take precedence."""
+    if not config.has_section('IRP_API'):
+        config.add_section('IRP_API')
+    irp = config['IRP_API']
+    for key, value in IRP_API_DEFAULTS.items():
+        if key not in irp:
+            irp[key] = value
+    if os.environ.get('USER_GSTIN'):
+        irp['UserGstin'] = os.environ['USER_GSTIN']
+    if os.environ.get('IRP_MODE'):
+        irp['Mode'] = os.environ['IRP_MODE']
+    return config
+
 def load_config():
-    """Load configuration from config.ini file."""
+    """Load configuration from config.ini file (with [IRP_API] defaults and environment overrides applied)."""
+    return _apply_irp_defaults(_read_config_file())
+
+def _read_config_file():
+    """Load config.ini exactly as stored (used when the file is written back)."""
     config = configparser.ConfigParser()
     config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
     
@@ -44,7 +97,7 @@ def get_current_user():
 
 def update_last_sync():
     """Update last sync time in config."""
-    config = load_config()
+    config = _read_config_file()  # Don't persist environment-derived [IRP_API] values
     if 'USER' not in config:
         config.add_section('USER')
     config['USER']['LastSync'] = get_current_time_utc()
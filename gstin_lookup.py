@@ -0,0 +1,265 @@
+# gstin_lookup.py
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config_manager import load_config
+from validator import is_valid_gstin
+
+# Load configuration
+CONFIG = load_config()
+CACHE_PATH = os.environ.get('GSTIN_CACHE_PATH') or CONFIG.get(
+    'GSTIN_CACHE', 'Path', fallback=os.path.join(os.path.dirname(__file__), 'gstin_cache.db'))
+
+# --- Cache tuning ([GSTIN_CACHE] section of config.ini, all optional) ---
+TTL_SECONDS = CONFIG.getfloat('GSTIN_CACHE', 'TTLHours', fallback=72.0) * 3600
+NEGATIVE_TTL_SECONDS = CONFIG.getfloat('GSTIN_CACHE', 'NegativeTTLHours', fallback=24.0) * 3600
+MEMORY_ENTRIES = CONFIG.getint('GSTIN_CACHE', 'MemoryEntries', fallback=2048)
+PREFETCH_WORKERS = CONFIG.getint('GSTIN_CACHE', 'PrefetchWorkers', fallback=4)
+
+# IRP taxpayer status codes that must not be used as a buyer (cancelled / inactive / suspended)
+INACTIVE_STATUSES = {'CNL', 'INA', 'SUS'}
+# IRP error codes meaning the GSTIN itself is unknown or not active - safe to cache negatively
+INVALID_GSTIN_ERROR_CODES = {'3028', '3029', '3074'}
+
+# Called before every IRP GSTIN request when set; shard workers point it at their rate limiter so
+# lookups count against the registration's IRP budget
+THROTTLE = None
+
+_memory = OrderedDict()  # gstin -> entry, most recently used last
+_memory_lock = threading.Lock()
+_db_lock = threading.Lock()
+
+
+def _connect():
+    """Open the on-disk cache, creating the table on first use."""
+    conn = sqlite3.connect(CACHE_PATH, timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS gstin_cache ("
+        " gstin TEXT PRIMARY KEY, valid INTEGER NOT NULL, details TEXT,"
+        " reason TEXT, fetched_at REAL NOT NULL)"
+    )
+    return conn
+
+
+def _is_fresh(entry, now=None):
+    """Positive and negative entries expire on separate TTLs."""
+    ttl = TTL_SECONDS if entry['valid'] else NEGATIVE_TTL_SECONDS
+    return ((now or time.time()) - entry['fetched_at']) < ttl
+
+
+def _remember(entry):
+    """Insert/refresh an entry in the in-memory LRU, evicting the oldest when full."""
+    with _memory_lock:
+        _memory[entry['gstin']] = entry
+        _memory.move_to_end(entry['gstin'])
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _from_memory(gstin):
+    with _memory_lock:
+        entry = _memory.get(gstin)
+        if entry is None:
+            return None
+        if not _is_fresh(entry):
+            del _memory[gstin]
+            return None
+        _memory.move_to_end(gstin)
+        return entry
+
+
+def _load_from_disk(gstins):
+    """Bulk-read fresh entries for the given GSTINs from the on-disk cache."""
+    if not gstins:
+        return {}
+    found = {}
+    now = time.time()
+    gstins = list(gstins)
+    with _db_lock:
+        conn = _connect()
+        try:
+            # SQLite limits bound parameters per statement; stay well below it
+            for start in range(0, len(gstins), 500):
+                chunk = gstins[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT gstin, valid, details, reason, fetched_at FROM gstin_cache WHERE gstin IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for gstin, valid, details, reason, fetched_at in rows:
+                    entry = {
+                        'gstin': gstin,
+                        'valid': bool(valid),
+                        'details': json.loads(details) if details else None,
+                        'reason': reason or '',
+                        'fetched_at': fetched_at,
+                    }
+                    if _is_fresh(entry, now):
+                        found[gstin] = entry
+        finally:
+            conn.close()
+    return found
+
+
+def _save_to_disk(entries):
+    if not entries:
+        return
+    rows = [
+        (e['gstin'], int(e['valid']), json.dumps(e['details']) if e['details'] else None, e['reason'], e['fetched_at'])
+        for e in entries
+    ]
+    with _db_lock:
+        conn = _connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO gstin_cache VALUES (?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+
+
+def _normalize_details(data):
+    """Map the IRP GetGSTINDetails 'Data' block onto BuyerDtls field names."""
+    addr1 = ", ".join(part for part in (data.get('AddrBno'), data.get('AddrFlno'), data.get('AddrBnm')) if part)
+    pin = str(data.get('AddrPncd') or '').strip()
+    state_code = str(data.get('StateCode') or '').strip()
+    return {
+        'LglNm': data.get('LegalName') or '',
+        'TrdNm': data.get('TradeName') or '',
+        'Addr1': addr1 or data.get('AddrSt') or '',
+        'Addr2': data.get('AddrSt') if addr1 else '',
+        'Loc': data.get('AddrLoc') or '',
+        'Pin': int(pin) if pin.isdigit() else None,
+        'Stcd': state_code.zfill(2) if state_code else '',  # Missing stays empty, never "00"
+        'TxpType': data.get('TxpType') or '',
+        'Status': data.get('Status') or '',
+    }
+
+
+def _fetch_from_irp(gstin, get_gstin_details):
+    """
+    Looks a GSTIN up on the IRP and turns the reply into a cache entry.
+    Returns None when the lookup failed for a transient reason (network, auth) so nothing is cached.
+    """
+    try:
+        if THROTTLE:
+            THROTTLE()
+        response_data = get_gstin_details(gstin)
+    except Exception as e:
+        print(f"GSTIN lookup failed for {gstin}: {e}")
+        return None
+
+    entry = {'gstin': gstin, 'valid': False, 'details': None, 'reason': '', 'fetched_at': time.time()}
+
+    if response_data.get("Status") == 1 and response_data.get("Data"):
+        details = _normalize_details(response_data["Data"])
+        entry['details'] = details
+        if details['Status'].upper() in INACTIVE_STATUSES:
+            entry['reason'] = f"GSTIN status is {details['Status']}"
+        else:
+            entry['valid'] = True
+        return entry
+
+    errors = response_data.get("ErrorDetails") or []
+    codes = {str(e.get('error_cd', e.get('ErrorCode', ''))) for e in errors}
+    if codes & INVALID_GSTIN_ERROR_CODES:
+        entry['reason'] = "; ".join(
+            f"Code {e.get('error_cd', e.get('ErrorCode', 'N/A'))}: {e.get('error_desc', e.get('ErrorMessage', 'Unknown'))}"
+            for e in errors
+        )
+        return entry
+
+    print(f"GSTIN lookup for {gstin} returned an unexpected response; not caching.")
+    return None
+
+
+def _resolve_locally(gstins):
+    """Resolve distinct GSTINs from memory, then disk. Returns (entries by gstin, set of misses)."""
+    results = {}
+    pending = set()
+    for gstin in gstins:
+        gstin = (gstin or '').strip().upper()
+        if not gstin or gstin in results or gstin in pending:
+            continue
+        if not is_valid_gstin(gstin):
+            # Malformed GSTINs never reach the IRP and are not worth persisting
+            results[gstin] = {'gstin': gstin, 'valid': False, 'details': None,
+                              'reason': 'Invalid GSTIN format', 'fetched_at': time.time()}
+            continue
+        entry = _from_memory(gstin)
+        if entry:
+            results[gstin] = entry
+        else:
+            pending.add(gstin)
+
+    if pending:
+        for gstin, entry in _load_from_disk(pending).items():
+            _remember(entry)
+            results[gstin] = entry
+            pending.discard(gstin)
+    return results, pending
+
+
+def cached_gstins(gstins):
+    """
+    Like prefetch_gstins, but never calls the IRP: misses are simply absent from the result.
+    For interactive paths (the GUI fetch) that must not wait on the network.
+    """
+    return _resolve_locally(gstins)[0]
+
+
+def prefetch_gstins(gstins):
+    """
+    Warms the cache for a batch of GSTINs (e.g. every buyer in one Tally fetch).
+    Distinct GSTINs are resolved memory -> disk -> IRP, and only true misses hit the network.
+    Returns a dict of gstin -> entry for every GSTIN that could be resolved.
+    """
+    results, pending = _resolve_locally(gstins)
+
+    if pending:
+        print(f"GSTIN cache: {len(results)} resolved locally, {len(pending)} lookups to IRP")
+        try:
+            # Imported lazily; irn_generator imports this module
+            from irn_generator import get_gstin_details, ensure_authenticated
+        except Exception as e:
+            print(f"GSTIN lookup unavailable, returning cached entries only: {e}")
+            return results
+        # Authenticate once up front; otherwise every pool thread would find no token and log in itself
+        try:
+            if not ensure_authenticated():
+                raise ConnectionError("IRP authentication failed")
+        except Exception as e:
+            print(f"GSTIN lookup unavailable, returning cached entries only: {e}")
+            return results
+        with ThreadPoolExecutor(max_workers=max(1, PREFETCH_WORKERS)) as pool:
+            fetched = [e for e in pool.map(lambda g: _fetch_from_irp(g, get_gstin_details), sorted(pending)) if e]
+        _save_to_disk(fetched)
+        for entry in fetched:
+            _remember(entry)
+            results[entry['gstin']] = entry
+
+    return results
+
+
+def lookup_gstin(gstin):
+    """Returns the cache entry for a single GSTIN, or None if it could not be resolved."""
+    gstin = (gstin or '').strip().upper()
+    return prefetch_gstins([gstin]).get(gstin)
+
+
+def clear_cache(disk=False):
+    """Drops the in-memory LRU, and optionally the on-disk cache as well."""
+    with _memory_lock:
+        _memory.clear()
+    if disk:
+        with _db_lock:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM gstin_cache")
+            finally:
+                conn.close()
@@ -1,7 +1,10 @@
 # irn_genrator.py
 import requests
 import json
+import threading
+import irp_codec
 from config_manager import load_config, get_api_credentials, IRP_SANDBOX_URL, IRP_PRODUCTION_URL # Import base URLs
+from gstin_lookup import lookup_gstin
 
 CONFIG = load_config() # Load config which includes [IRP_API] section
 
@@ -19,12 +22,14 @@ IRP_GENERATE_ENDPOINT = f"{BASE_URL}{GENERATE_PATH}"
 # Add others if needed (Cancel, GetIrnDetails etc.)
 # IRP_CANCEL_ENDPOINT = f"{BASE_URL}{CONFIG['IRP_API'].get('CancelPath', '/ewaybillapi/v1.04/invoice/cancel')}"
 # IRP_GETIRN_ENDPOINT = f"{BASE_URL}{CONFIG['IRP_API'].get('GetIrnDetailsPath', '/ewaybillapi/v1.04/invoice/irn')}"
-# IRP_GETGSTIN_ENDPOINT = f"{BASE_URL}{CONFIG['IRP_API'].get('GetGstinDetailsPath', '/ewaybillapi/v1.04/master/gstin')}"
+IRP_GETGSTIN_ENDPOINT = f"{BASE_URL}{CONFIG['IRP_API'].get('GetGstinDetailsPath', '/ewaybillapi/v1.04/master/gstin')}"
 
 
 # Placeholder for authentication token (This token is from the IRP, not the GSP itself unless GSP acts as pure proxy)
 IRP_AUTH_TOKEN = None # Renamed for clarity
 SEK = None # Session Encryption Key, often received with auth token
+SESSION = requests.Session() # Keep-alive connection pool to the IRP (one per process)
+_AUTH_LOCK = threading.Lock() # One authentication at a time (the GSTIN prefetch calls from a thread pool)
 
 # --- Authentication Function (Now targeting IRP Auth) ---
 def authenticate_irp():
@@ -57,11 +62,11 @@ def authenticate_irp():
     # print(f"Auth Payload: {json.dumps(payload)}") # Avoid logging password
 
     try:
-        response = requests.post(IRP_AUTH_ENDPOINT, headers=headers, json=payload, timeout=30)
+        response = SESSION.post(IRP_AUTH_ENDPOINT, headers=headers, json=payload, timeout=30)
         print(f"Auth Response Status Code: {response.status_code}")
         # print(f"Auth Response Body: {response.text}") # Debug carefully
 
-        response_data = response.json()
+        response_data = irp_codec.loads(response.content)
 
         if response.status_code == 200 and response_data.get("Status") == 1 and response_data.get("Data"):
             auth_data = response_data["Data"]
@@ -93,13 +98,30 @@ def authenticate_irp():
         raise
 
 
+def ensure_authenticated():
+    """
+    Authenticate unless a token/SEK is already held. Serialized, so concurrent callers wait for a
+    single AUTH call instead of each sending their own (the IRP rate-limits authentication).
+    """
+    with _AUTH_LOCK:
+        if IRP_AUTH_TOKEN and SEK:
+            return True
+        print("IRP Authentication token/SEK not available. Attempting authentication...")
+        return authenticate_irp()
+
+
 # --- format_invoice_json function remains the same ---
 def format_invoice_json(invoice_tally_data):
     # ... (Keep your existing JSON formatting logic) ...
     # !!! ENSURE THIS MAPS CORRECTLY TO IRP SCHEMA v1.1 !!!
     # You MUST get all required details like Seller/Buyer GSTIN, addresses, HSN, rates etc.
     # from the Tally data ('raw_data' in tally_connector is a good place to start).
-    print(f"Formatting JSON for Voucher: {invoice_tally_data.get('voucher_no', 'N/A')}")
+    print(f"Formatting JSON for Voucher: {invoice_tally_data.get('voucher_number', 'N/A')}")
+
+    # --- Buyer master data from the GSTIN cache (prefetched per Tally fetch, so usually a local hit) ---
+    buyer_gstin = invoice_tally_data.get('party_gstin', '')
+    buyer_info = lookup_gstin(buyer_gstin) if buyer_gstin else None
+    buyer = (buyer_info or {}).get('details') or {}
 
     # --- Placeholder JSON structure ---
     # !!! THIS IS EXTREMELY SIMPLIFIED - REPLACE WITH ACTUAL IRP SCHEMA MAPPING !!!
@@ -113,7 +135,7 @@ def format_invoice_json(invoice_tally_data):
         },
         "DocDtls": {
             "Typ": "INV", # Determine Type (INV, CRN, DBN) from Tally Voucher Type
-            "No": str(invoice_tally_data.get('voucher_no', '')), # Ensure string
+            "No": str(invoice_tally_data.get('voucher_number', '')), # Ensure string (key as emitted by parse_voucher_data)
             "Dt": "25/10/2023" # !!! Needs proper date formatting DD/MM/YYYY from invoice_tally_data['date'] !!!
         },
         "SellerDtls": {
@@ -129,15 +151,15 @@ def format_invoice_json(invoice_tally_data):
             "Em": "seller@example.com" # Optional
         },
          "BuyerDtls": {
-            "Gstin": "BUYER_GSTIN_FROM_PARTY", # !!! Get from Tally Party Ledger !!!
-            "LglNm": invoice_tally_data.get('party_name', ''), # !!! Get Legal Name from Party Ledger !!!
-            "TrdNm": "BUYER_TRADE_NAME_IF_DIFFERENT",
+            "Gstin": buyer_gstin or "BUYER_GSTIN_FROM_PARTY", # From Tally Party Ledger
+            "LglNm": buyer.get('LglNm') or invoice_tally_data.get('party_name', ''), # IRP legal name, falls back to Tally party name
+            "TrdNm": buyer.get('TrdNm') or "BUYER_TRADE_NAME_IF_DIFFERENT",
             "Pos": "05", # !!! Place of Supply (State Code) - Determine from Tally Invoice !!! CRITICAL
-            "Addr1": "BUYER_ADDR1", # !!! Get from Party Ledger !!!
-            "Addr2": "BUYER_ADDR2", # Optional
-            "Loc": "BUYER_LOCATION", # !!! Get from Party Ledger !!!
-            "Pin": 110001, # !!! Get from Party Ledger (needs to be integer) !!!
-            "Stcd": "07", # !!! Get State Code from Party Ledger !!!
+            "Addr1": buyer.get('Addr1') or "BUYER_ADDR1", # From IRP GSTIN master, else Party Ledger
+            "Addr2": buyer.get('Addr2') or "BUYER_ADDR2", # Optional
+            "Loc": buyer.get('Loc') or "BUYER_LOCATION", # From IRP GSTIN master, else Party Ledger
+            "Pin": buyer.get('Pin') or 110001, # From IRP GSTIN master (integer)
+            "Stcd": buyer.get('Stcd') or "07", # From IRP GSTIN master
             "Ph": "7777766666", # Optional
             "Em": "buyer@example.com" # Optional
         },
@@ -184,22 +206,21 @@ def format_invoice_json(invoice_tally_data):
     # You need to encrypt the json_payload using the SEK from authentication
     # Usually AES-256-CBC encryption, base64 encoded.
     # This requires the 'cryptography' library. Implement this carefully!
-    # encrypted_payload = encrypt_payload(json.dumps(json_payload), SEK) # Placeholder
-    # final_data_to_send = json.dumps({"Data": encrypted_payload})
+    # encrypted_payload = encrypt_payload(irp_codec.encode_payload(json_payload), SEK) # Placeholder
+    # final_data_to_send = irp_codec.encode_envelope(encrypted_payload)
 
     # --- FOR NOW: Return unencrypted JSON string for structure testing ---
     # !!! REPLACE THIS WITH ENCRYPTED PAYLOAD LOGIC LATER !!!
-    final_data_to_send = json.dumps({"Data": json.dumps(json_payload)}) # Simulating structure
+    # encode_payload applies schema key order, drops empty optionals and rounds to IRP precision
+    final_data_to_send = irp_codec.encode_envelope(irp_codec.encode_payload(json_payload)) # Simulating structure
 
     return final_data_to_send
 
 
 def generate_irn(encrypted_json_payload_str): # Pass the { "Data": "encrypted..." } structure
     """Sends the formatted and encrypted JSON to the IRP Generate endpoint."""
-    if not IRP_AUTH_TOKEN or not SEK: # Check for IRP token and SEK
-        print("IRP Authentication token/SEK not available. Attempting authentication...")
-        if not authenticate_irp(): # Use IRP auth function
-            raise ConnectionError("IRP Authentication Failed. Cannot generate IRN.")
+    if not ensure_authenticated(): # Check for IRP token and SEK, authenticating once if needed
+        raise ConnectionError("IRP Authentication Failed. Cannot generate IRN.")
 
     username, _ = get_api_credentials() # Still needed for headers
     user_gstin = CONFIG['IRP_API'].get('UserGstin')
@@ -220,7 +241,7 @@ def generate_irn(encrypted_json_payload_str): # Pass the { "Data": "encrypted...
     # print(f"Payload (Structure check): {encrypted_json_payload_str[:100]}...") # Log only start of payload
 
     try:
-        response = requests.post(
+        response = SESSION.post(
             IRP_GENERATE_ENDPOINT,
             headers=headers,
             data=encrypted_json_payload_str.encode('utf-8'), # Send the { "Data": "encrypted..." } JSON string
@@ -242,17 +263,50 @@ def generate_irn(encrypted_json_payload_str): # Pass the { "Data": "encrypted...
 
     except requests.exceptions.RequestException as e:
         print(f"Error calling IRP API: {e}")
-        return json.dumps({"Success": "false", "ErrorDetails": [{"ErrorCode": "NET_ERROR", "ErrorMessage": str(e)}]})
+        return irp_codec.dumps({"Success": "false", "ErrorDetails": [{"ErrorCode": "NET_ERROR", "ErrorMessage": str(e)}]})
     except Exception as e:
         print(f"An unexpected error occurred during API call: {e}")
-        return json.dumps({"Success": "false", "ErrorDetails": [{"ErrorCode": "PY_ERROR", "ErrorMessage": f"Unexpected Python error: {e}"}]})
+        return irp_codec.dumps({"Success": "false", "ErrorDetails": [{"ErrorCode": "PY_ERROR", "ErrorMessage": f"Unexpected Python error: {e}"}]})
+
+def get_gstin_details(gstin):
+    """
+    Fetches taxpayer details for a GSTIN from the IRP master API.
+    Returns the IRP response dict (Status/Data/ErrorDetails) or raises ConnectionError on network failure.
+    """
+    if not ensure_authenticated():
+        raise ConnectionError("IRP Authentication Failed. Cannot look up GSTIN.")
+
+    username, _ = get_api_credentials()
+    user_gstin = CONFIG['IRP_API'].get('UserGstin')
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'authtoken': IRP_AUTH_TOKEN,
+        'user_name': username,
+        'Gstin': user_gstin,
+    }
+
+    print(f"Looking up GSTIN {gstin} at: {IRP_GETGSTIN_ENDPOINT}")
+
+    try:
+        response = SESSION.get(f"{IRP_GETGSTIN_ENDPOINT}/{gstin}", headers=headers, timeout=30)
+        print(f"GSTIN Lookup Response Status Code: {response.status_code}")
+        # --- Response Data is SEK-encrypted in production; see decrypt_response note below ---
+        return irp_codec.loads(response.content)
+    except requests.exceptions.RequestException as e:
+        print(f"Error calling IRP GSTIN API: {e}")
+        raise ConnectionError(f"Network error during GSTIN lookup: {e}")
+    except json.JSONDecodeError:
+        print(f"Failed to decode IRP GSTIN JSON response. Status: {response.status_code}")
+        raise ValueError("Invalid JSON response from IRP GSTIN lookup.")
 
 # --- parse_response function remains mostly the same ---
 # It now parses the decrypted JSON response from IRP
 def parse_response(decrypted_api_response_text):
     """Parses the DECRYPTED JSON response from the IRP."""
     try:
-        response_data = json.loads(decrypted_api_response_text)
+        response_data = irp_codec.loads(decrypted_api_response_text)
 
         # Check for standard IRP success structure first
         if response_data.get("Status") == 1 and response_data.get("Data", {}).get("Irn"):
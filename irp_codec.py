@@ -0,0 +1,149 @@
+# irp_codec.py
+#
+# Single place where IRP payloads and responses are turned into / out of JSON.
+# - Compact output (no whitespace) with the key order of the IRP v1.1 schema
+# - Optional fields that are None / "" / {} / [] are dropped
+# - Amounts rounded to 2 decimals, quantities/unit prices/rates to 3 (IRP limits)
+# - orjson is the expected backend (pip install orjson). The standard json module is a working
+#   fallback; the canonical pass is pure Python and costs the same on both.
+# - Every payload goes through the canonical pass. It is one walk over the payload: per-section
+#   rank/precision tables are built at import, only known numeric fields are rounded, and a
+#   section is sorted only when its keys arrive out of schema order.
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Expected backend; fall back to the standard library
+    orjson = None
+    print("irp_codec: orjson not installed, using the slower standard json backend (pip install orjson)")
+
+# --- Key order per IRP schema v1.1 section ---
+_PARTY_ORDER = ["Gstin", "LglNm", "TrdNm", "Pos", "Addr1", "Addr2", "Loc", "Pin", "Stcd", "Ph", "Em"]
+_SECTION_KEY_ORDER = {
+    None: ["Version", "TranDtls", "DocDtls", "SellerDtls", "BuyerDtls", "DispDtls", "ShipDtls",
+           "ItemList", "ValDtls", "PayDtls", "RefDtls", "AddlDocDtls", "ExpDtls", "EwbDtls"],
+    "TranDtls": ["TaxSch", "SupTyp", "RegRev", "EcmGstin", "IgstOnIntra"],
+    "DocDtls": ["Typ", "No", "Dt"],
+    "SellerDtls": _PARTY_ORDER,
+    "BuyerDtls": _PARTY_ORDER,
+    "DispDtls": ["Nm", "Addr1", "Addr2", "Loc", "Pin", "Stcd"],
+    "ShipDtls": _PARTY_ORDER,
+    "ItemList": ["SlNo", "PrdDesc", "IsServc", "HsnCd", "Barcde", "Qty", "FreeQty", "Unit", "UnitPrice",
+                 "TotAmt", "Discount", "PreTaxVal", "AssAmt", "GstRt", "IgstAmt", "CgstAmt", "SgstAmt",
+                 "CesRt", "CesAmt", "CesNonAdvlAmt", "StateCesRt", "StateCesAmt", "StateCesNonAdvlAmt",
+                 "OthChrg", "TotItemVal", "OrdLineRef", "OrgCntry", "PrdSlNo", "BchDtls", "AttribDtls"],
+    "ValDtls": ["AssVal", "CgstVal", "SgstVal", "IgstVal", "CesVal", "StCesVal", "Discount", "OthChrg",
+                "RndOffAmt", "TotInvVal", "TotInvValFc"],
+}
+
+# Fields the IRP accepts with 3 decimals, and the amount fields it accepts with 2
+THREE_DECIMAL_FIELDS = {"Qty", "FreeQty", "UnitPrice", "GstRt", "CesRt", "StateCesRt"}
+TWO_DECIMAL_FIELDS = {"TotAmt", "Discount", "PreTaxVal", "AssAmt", "IgstAmt", "CgstAmt", "SgstAmt", "CesAmt",
+                      "CesNonAdvlAmt", "StateCesAmt", "StateCesNonAdvlAmt", "OthChrg", "TotItemVal",
+                      "AssVal", "CgstVal", "SgstVal", "IgstVal", "CesVal", "StCesVal", "RndOffAmt",
+                      "TotInvVal", "TotInvValFc"}
+
+
+# Per-section lookup tables, built once: key -> schema rank, and numeric key -> decimals
+_SECTION_RANK = {section: {key: i for i, key in enumerate(keys)} for section, keys in _SECTION_KEY_ORDER.items()}
+_SECTION_DIGITS = {section: {key: 3 if key in THREE_DECIMAL_FIELDS else 2 for key in keys
+                            if key in THREE_DECIMAL_FIELDS or key in TWO_DECIMAL_FIELDS}
+                   for section, keys in _SECTION_KEY_ORDER.items()}
+_UNKNOWN_RANK = 1 << 30  # Keys outside the schema sort after every known key
+_NO_FIELDS = {}
+
+
+def _canonical(value, section=None):
+    """Recursively drop empty optionals, round known numeric fields and order keys."""
+    rank = _SECTION_RANK.get(section, _NO_FIELDS)
+    digits = _SECTION_DIGITS.get(section, _NO_FIELDS)
+    out = {}
+    last = -1
+    in_order = True
+    for k, v in value.items():
+        t = type(v)
+        if t is float:
+            n = digits.get(k)
+            if n:
+                v = round(v, n)
+        elif t is str:
+            if not v:
+                continue
+        elif t is dict:
+            v = _canonical(v, k)
+            if not v:
+                continue
+        elif t is list:
+            # List items take their key order from the list's own section (e.g. ItemList entries)
+            v = [_canonical(item, k) if type(item) is dict else item for item in v]
+            if not v:
+                continue
+        elif v is None:
+            continue
+        out[k] = v
+        # Unknown keys tie on rank and are ordered alphabetically, so two of them force a sort
+        r = rank.get(k, _UNKNOWN_RANK)
+        if r <= last:
+            in_order = False
+        last = r
+    if in_order:
+        return out
+    # Known keys in schema order, unknown keys afterwards alphabetically (still deterministic)
+    return {k: out[k] for k in sorted(out, key=lambda k: (rank.get(k, _UNKNOWN_RANK), k))}
+
+
+def canonicalize(payload):
+    """Return a new dict in canonical IRP form (see module notes)."""
+    return _canonical(payload)
+
+
+# --- Backends ---
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode("utf-8")
+
+
+BACKENDS = {"json": (_json_dumps, json.loads)}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_dumps, orjson.loads)
+
+BACKEND = "orjson" if orjson is not None else "json"
+_dumps, _loads = BACKENDS[BACKEND]
+
+
+def use_backend(name):
+    """Switch the active backend ('json' or 'orjson'); raises ValueError if it is not available."""
+    global BACKEND, _dumps, _loads
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend '{name}' is not available. Installed: {', '.join(BACKENDS)}")
+    BACKEND = name
+    _dumps, _loads = BACKENDS[name]
+
+
+def dumps(obj):
+    """Compact JSON text for any object (no canonicalization)."""
+    return _dumps(obj)
+
+
+def loads(text):
+    """Parse JSON text or bytes. Errors are json.JSONDecodeError for every backend."""
+    return _loads(text)
+
+
+def encode_payload(payload):
+    """Canonical, compact JSON for an IRP invoice payload."""
+    return _dumps(_canonical(payload))
+
+
+def encode_envelope(data_str):
+    """Wrap an (encrypted or plain) payload string in the IRP {"Data": ...} request envelope."""
+    return _dumps({"Data": data_str})
+
+
+def decode_envelope(envelope_str):
+    """Inverse of encode_envelope(encode_payload(...)) for unencrypted payloads - returns the invoice dict."""
+    return _loads(_loads(envelope_str)["Data"])
@@ -4,7 +4,7 @@ import sys
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QDateEdit, QTableWidget, QTableWidgetItem, QHeaderView, QMessageBox, QProgressBar
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QIcon
-from tally_connector import fetch_pending_invoices, update_tally_voucher
+from tally_connector import fetch_pending_invoices, update_tally_voucher, PRIORITY_INTERACTIVE
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -41,9 +41,9 @@ class MainWindow(QMainWindow):
 
         # Table
         self.table = QTableWidget()
-        self.table.setColumnCount(10)
+        self.table.setColumnCount(11)
         self.table.setHorizontalHeaderLabels(
-            ["Select", "Voucher No", "Date", "Party Name", "GSTIN", "Destination", "Taxable Amt", "CGST", "SGST", "IGST"]
+            ["Select", "Voucher No", "Date", "Party Name", "GSTIN", "Destination", "Taxable Amt", "CGST", "SGST", "IGST", "GSTIN Status"]
         )
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         layout.addWidget(self.table)
@@ -58,7 +58,7 @@ class MainWindow(QMainWindow):
             from_date = self.from_date.date().toString("dd-MM-yyyy")
             to_date = self.to_date.date().toString("dd-MM-yyyy")
 
-            invoices = fetch_pending_invoices(from_date, to_date)
+            invoices = fetch_pending_invoices(from_date, to_date, priority=PRIORITY_INTERACTIVE)
             self.table.setRowCount(len(invoices))
 
             for row, invoice in enumerate(invoices):
@@ -71,6 +71,7 @@ class MainWindow(QMainWindow):
                 self.table.setItem(row, 7, QTableWidgetItem(str(invoice['cgst_amount'])))
                 self.table.setItem(row, 8, QTableWidgetItem(str(invoice['sgst_amount'])))
                 self.table.setItem(row, 9, QTableWidgetItem(str(invoice['igst_amount'])))
+                self.table.setItem(row, 10, QTableWidgetItem(invoice.get('gstin_status', 'Unknown')))
 
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to fetch invoices: {e}")
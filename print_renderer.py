@@ -0,0 +1,145 @@
+# print_renderer.py
+#
+# Turns generated e-invoices (parse_response results) into print artifacts:
+#   <OutputDir>/<irn[:2]>/<irn>/qr.png, qr.svg, summary.txt
+# An IRN identifies exactly one signed invoice, so artifacts are stored by IRN and never
+# re-rendered: a re-print is a directory lookup. Rendering runs in a process pool.
+#
+# Requires the 'qrcode' package (pip install qrcode[pil]); PNG output falls back to
+# pure-Python PNG writing (pypng) when Pillow is not installed.
+
+import os
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from config_manager import load_config
+
+try:
+    import qrcode
+    import qrcode.image.svg
+except ImportError:  # Optional dependency - only needed when rendering
+    qrcode = None
+
+CONFIG = load_config()
+OUTPUT_DIR = CONFIG.get('PRINT', 'OutputDir',
+                        fallback=os.path.join(os.path.dirname(__file__), 'print_artifacts'))
+ARTIFACT_FILES = ('qr.png', 'qr.svg', 'summary.txt')
+
+
+def artifact_dir(irn, output_dir=None):
+    """Directory holding the artifacts for one IRN (two-level fan-out keeps directories small)."""
+    return os.path.join(output_dir or OUTPUT_DIR, irn[:2], irn)
+
+
+def is_rendered(irn, output_dir=None):
+    folder = artifact_dir(irn, output_dir)
+    return all(os.path.exists(os.path.join(folder, name)) for name in ARTIFACT_FILES)
+
+
+def format_summary_block(invoice):
+    """Plain-text IRN block printed alongside the QR code."""
+    return "\n".join([
+        "e-Invoice",
+        f"IRN      : {invoice.get('irn', '')}",
+        f"Ack No.  : {invoice.get('ack_no', '')}",
+        f"Ack Date : {invoice.get('ack_date', '')}",
+        f"Invoice  : {invoice.get('voucher_number', '')}",
+    ]) + "\n"
+
+
+def _make_qr(data):
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=4, border=4)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def _render_one(invoice, output_dir):
+    """Render one invoice's artifacts (runs in a pool worker). Returns (irn, folder)."""
+    irn = invoice['irn']
+    folder = artifact_dir(irn, output_dir)
+    if is_rendered(irn, output_dir):
+        return irn, folder
+
+    # Write into a private temp folder and move it into place, so readers never see partial output
+    tmp = f"{folder}.tmp-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        qr = _make_qr(invoice['qr_code'])
+        try:
+            png = qr.make_image()
+        except ImportError:
+            from qrcode.image.pure import PyPNGImage
+            png = qr.make_image(image_factory=PyPNGImage)
+        with open(os.path.join(tmp, 'qr.png'), 'wb') as f:
+            png.save(f)
+        with open(os.path.join(tmp, 'qr.svg'), 'wb') as f:
+            qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(f)
+        with open(os.path.join(tmp, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(format_summary_block(invoice))
+
+        if os.path.isdir(folder) and not is_rendered(irn, output_dir):
+            shutil.rmtree(folder, ignore_errors=True)  # Left over from an interrupted copy/cleanup
+        try:
+            os.replace(tmp, folder)
+        except OSError:
+            pass  # Another worker/run finished the same IRN first; its output is identical
+    finally:
+        # Gone after a successful move; otherwise a failed or redundant render must not leave it behind
+        shutil.rmtree(tmp, ignore_errors=True)
+    return irn, folder
+
+
+def render_batch(invoices, output_dir=None, workers=None):
+    """
+    Render QR PNG/SVG and summary blocks for every generated invoice.
+    invoices: dicts with irn, qr_code, ack_no, ack_date, voucher_number (as returned by parse_response
+    plus the voucher number). Entries without an IRN or QR code are skipped.
+    Returns {irn: artifact folder}.
+    """
+    if qrcode is None:
+        raise ImportError("QR rendering needs the 'qrcode' package: pip install qrcode[pil]")
+    output_dir = output_dir or OUTPUT_DIR
+
+    results = {}
+    todo = {}
+    for invoice in invoices:
+        irn = invoice.get('irn')
+        if not irn or not invoice.get('qr_code'):
+            continue
+        if is_rendered(irn, output_dir):
+            results[irn] = artifact_dir(irn, output_dir)
+        else:
+            todo[irn] = invoice  # De-duplicates repeated IRNs in one batch
+
+    print(f"Print artifacts: {len(results)} cached, {len(todo)} to render")
+    if todo:
+        os.makedirs(output_dir, exist_ok=True)
+        if len(todo) == 1 or workers == 1:
+            rendered = [_render_one(inv, output_dir) for inv in todo.values()]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                rendered = list(pool.map(_render_one, todo.values(), [output_dir] * len(todo), chunksize=16))
+        results.update(rendered)
+    return results
+
+
+def export_artifacts(irns, destination, output_dir=None):
+    """
+    Copy rendered artifacts for the given IRNs to a directory, or into a ZIP when destination ends in .zip.
+    Files are laid out as <irn>/<file>. Returns the number of invoices exported.
+    """
+    irns = [irn for irn in dict.fromkeys(irns) if is_rendered(irn, output_dir)]
+    if destination.lower().endswith('.zip'):
+        # PNGs are already compressed; deflating only helps the text/SVG files
+        with zipfile.ZipFile(destination, 'w') as zf:
+            for irn in irns:
+                folder = artifact_dir(irn, output_dir)
+                for name in ARTIFACT_FILES:
+                    compress = zipfile.ZIP_STORED if name.endswith('.png') else zipfile.ZIP_DEFLATED
+                    zf.write(os.path.join(folder, name), f"{irn}/{name}", compress_type=compress)
+    else:
+        for irn in irns:
+            shutil.copytree(artifact_dir(irn, output_dir), os.path.join(destination, irn), dirs_exist_ok=True)
+    print(f"Exported print artifacts for {len(irns)} invoice(s) to {destination}")
+    return len(irns)
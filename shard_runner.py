@@ -0,0 +1,245 @@
+# shard_runner.py
+#
+# Sharded e-invoice processing: one worker process per (Tally endpoint, company, GSTIN).
+# Each worker imports tally_connector / irn_generator fresh, so it gets its own HTTP
+# connection pools, IRP token/SEK and rate-limit budget. The supervisor only collects
+# progress messages and per-shard summaries.
+#
+# Shards are configured in config.ini, one section per registration:
+#
+#   [SHARD:North]
+#   TallyUrl = http://localhost:9000
+#   Company = ABC Traders (Delhi)
+#   UserGstin = 07AAACA1234A1Z5
+#   RequestsPerMinute = 60
+#   CredentialsPrefix = NORTH      ; reads NORTH_IRP_API_USERNAME / NORTH_IRP_API_PASSWORD from the environment
+#                                  ; (required once a prefix is set - the shard fails without them)
+#
+# Note: a single Tally instance serves one request at a time. Shards sharing a TallyUrl (and the
+# GUI) coordinate through tally_scheduler's endpoint gate: one request in flight, one shared
+# busy-ratio budget, interactive requests first. IRP calls are what scale out.
+
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import multiprocessing
+import irp_codec
+from config_manager import load_config, get_current_time_utc
+
+DEFAULT_REQUESTS_PER_MINUTE = 60
+SHARD_SECTION_PREFIX = 'SHARD:'
+
+
+def load_shards(config=None):
+    """
+    Read shard definitions from config.ini.
+    Falls back to a single shard built from the [TALLY] / [IRP_API] sections when none are defined.
+    """
+    config = config or load_config()
+    shards = []
+    for section in config.sections():
+        if not section.upper().startswith(SHARD_SECTION_PREFIX):
+            continue
+        opts = config[section]
+        shards.append({
+            'name': section[len(SHARD_SECTION_PREFIX):].strip(),
+            'tally_url': opts.get('TallyUrl', f"http://localhost:{opts.get('TallyPort', '9000')}"),
+            'company': opts.get('Company', ''),
+            'user_gstin': opts.get('UserGstin', ''),
+            'requests_per_minute': opts.getint('RequestsPerMinute', fallback=DEFAULT_REQUESTS_PER_MINUTE),
+            'credentials_prefix': opts.get('CredentialsPrefix', ''),
+        })
+
+    if not shards:
+        shards.append({
+            'name': 'default',
+            'tally_url': f"http://localhost:{config.get('TALLY', 'Port', fallback='9000')}",
+            'company': config.get('TALLY', 'Company', fallback=''),
+            'user_gstin': config.get('IRP_API', 'UserGstin', fallback=''),
+            'requests_per_minute': config.getint('IRP_API', 'RequestsPerMinute', fallback=DEFAULT_REQUESTS_PER_MINUTE),
+            'credentials_prefix': '',
+        })
+    return shards
+
+
+class _RateLimiter:
+    """Spaces calls evenly so a shard never exceeds its requests-per-minute budget."""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()  # Shared by the GSTIN prefetch threads
+
+    def wait(self):
+        with self.lock:  # Claim a slot under the lock, sleep outside it
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _configure_worker(shard):
+    """Point this process's module globals at the shard's Tally endpoint, company and GSTIN."""
+    prefix = shard['credentials_prefix']
+    if prefix:
+        # Must happen before irn_generator is imported, since credentials are read from the environment.
+        # Never fall back to the global credentials: they belong to another registration.
+        missing = [f"{prefix}_{key}" for key in ('IRP_API_USERNAME', 'IRP_API_PASSWORD') if not os.environ.get(f"{prefix}_{key}")]
+        if missing:
+            raise ValueError(f"Shard {shard['name']}: credentials not set in the environment: {', '.join(missing)}")
+        for key in ('IRP_API_USERNAME', 'IRP_API_PASSWORD'):
+            os.environ[key] = os.environ[f"{prefix}_{key}"]
+    if shard['user_gstin']:
+        os.environ['USER_GSTIN'] = shard['user_gstin']
+
+    import tally_connector
+    import irn_generator
+
+    tally_connector.TALLY_URL = shard['tally_url']
+    tally_connector.TALLY_COMPANY = shard['company']
+    if shard['user_gstin']:
+        if not irn_generator.CONFIG.has_section('IRP_API'):
+            irn_generator.CONFIG.add_section('IRP_API')
+        irn_generator.CONFIG['IRP_API']['UserGstin'] = shard['user_gstin']
+    return tally_connector, irn_generator
+
+
+def _shard_worker(shard, from_date, to_date, messages):
+    """Fetch -> generate IRN -> write back for one shard. Runs in its own process."""
+    name = shard['name']
+    summary = {'shard': name, 'fetched': 0, 'generated': 0, 'failed': 0, 'errors': [],
+               'generated_invoices': [], 'started_at': get_current_time_utc()}
+    try:
+        tally_connector, irn_generator = _configure_worker(shard)
+        from validator import validate_invoice_data_for_irn
+        import gstin_lookup
+        limiter = _RateLimiter(shard['requests_per_minute'])
+        gstin_lookup.THROTTLE = limiter.wait  # GSTIN lookups spend the same per-registration IRP budget
+
+        invoices = tally_connector.fetch_pending_invoices(from_date, to_date)
+        summary['fetched'] = len(invoices)
+        # Network GSTIN lookups happen here, not in the fetch (which the GUI also uses)
+        gstin_lookup.prefetch_gstins(inv['party_gstin'] for inv in invoices if inv['party_gstin'])
+        messages.put(('progress', name, 0, len(invoices)))
+
+        for done, invoice in enumerate(invoices, start=1):
+            voucher_no = invoice.get('voucher_number', '')
+            payload = irn_generator.format_invoice_json(invoice)
+            # Cached by the prefetch above, so this is a local hit; rejects cancelled/unknown buyers
+            buyer_info = gstin_lookup.lookup_gstin(invoice.get('party_gstin'))
+            validation = validate_invoice_data_for_irn(irp_codec.decode_envelope(payload), buyer_info)
+            if validation is not True:
+                result = {'status': 'Failed', 'error_msg': "; ".join(validation)}
+            else:
+                limiter.wait()
+                result = irn_generator.parse_response(irn_generator.generate_irn(payload))
+
+            if result.get('status') == 'Generated':
+                summary['generated'] += 1
+                # Kept for the print stage (run_sharded -> print_renderer), which runs in the supervisor
+                summary['generated_invoices'].append(dict(result, voucher_number=voucher_no))
+            else:
+                summary['failed'] += 1
+                summary['errors'].append(f"{voucher_no}: {result.get('error_msg', '')}")
+
+            # Write-back alters the voucher by its GUID; without one we cannot target it safely
+            if not invoice.get('guid'):
+                summary['errors'].append(f"{voucher_no}: write-back skipped: voucher GUID missing from Tally export")
+            else:
+                ok, msg = tally_connector.update_tally_voucher(invoice['guid'], result)
+                if not ok:
+                    summary['errors'].append(f"{voucher_no}: write-back failed: {msg}")
+            messages.put(('progress', name, done, len(invoices)))
+
+    except Exception as e:
+        summary['errors'].append(f"Shard aborted: {e}")
+    summary['finished_at'] = get_current_time_utc()
+    messages.put(('done', name, summary))
+
+
+def run_sharded(from_date, to_date, shards=None, on_progress=None, render_artifacts=True, output_dir=None):
+    """
+    Process every shard in parallel, one process each.
+    on_progress(shard_name, done, total) is called in the supervisor process as workers report.
+    With render_artifacts, print artifacts (print_renderer) are rendered for every generated invoice
+    once all shards finish; each summary gets 'artifacts': {irn: folder}.
+    Returns {shard_name: summary}.
+    """
+    shards = shards if shards is not None else load_shards()
+    names = [s['name'] for s in shards]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Shard names must be unique: {names}")
+
+    # spawn: workers never inherit the supervisor's sessions/tokens (and it is the only option on Windows)
+    ctx = multiprocessing.get_context('spawn')
+    messages = ctx.Queue()
+    processes = {}
+    for shard in shards:
+        proc = ctx.Process(target=_shard_worker, args=(shard, from_date, to_date, messages),
+                           name=f"einvoice-{shard['name']}", daemon=True)
+        proc.start()
+        processes[shard['name']] = proc
+    print(f"Started {len(processes)} shard worker(s): {', '.join(processes)}")
+
+    results = {}
+    while len(results) < len(processes):
+        try:
+            message = messages.get(timeout=1)
+        except queue.Empty:
+            # A worker that died without reporting (crash, kill) must not hang the supervisor
+            for name, proc in processes.items():
+                if name not in results and not proc.is_alive() and proc.exitcode not in (None, 0):
+                    results[name] = {'shard': name, 'fetched': 0, 'generated': 0, 'failed': 0,
+                                     'errors': [f"Worker exited with code {proc.exitcode}"],
+                                     'generated_invoices': []}
+            continue
+
+        if message[0] == 'progress':
+            _, name, done, total = message
+            if on_progress:
+                on_progress(name, done, total)
+        elif message[0] == 'done':
+            _, name, summary = message
+            results[name] = summary
+            print(f"Shard {name}: fetched {summary['fetched']}, generated {summary['generated']}, failed {summary['failed']}")
+
+    for proc in processes.values():
+        proc.join(timeout=5)
+
+    if render_artifacts:
+        _render_artifacts(results, output_dir)
+    return results
+
+
+def _render_artifacts(results, output_dir=None):
+    """Render QR/summary artifacts in the supervisor: daemonic shard workers cannot own a process pool."""
+    generated = [inv for s in results.values() for inv in s.get('generated_invoices', [])]
+    if not generated:
+        return
+    try:
+        from print_renderer import render_batch
+        rendered = render_batch(generated, output_dir)
+    except Exception as e:  # Printing must never lose the generation results
+        print(f"Skipping print artifacts: {e}")
+        return
+    for summary in results.values():
+        summary['artifacts'] = {inv['irn']: rendered[inv['irn']]
+                                for inv in summary.get('generated_invoices', []) if inv.get('irn') in rendered}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python shard_runner.py <from DD-MM-YYYY> <to DD-MM-YYYY>")
+        sys.exit(1)
+
+    def _print_progress(name, done, total):
+        print(f"[{name}] {done}/{total}")
+
+    summaries = run_sharded(sys.argv[1], sys.argv[2], on_progress=_print_progress)
+    for s in summaries.values():
+        s.pop('generated_invoices', None)
+    print(json.dumps(summaries, indent=2))
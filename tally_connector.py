@@ -5,14 +5,27 @@ import xmltodict
 import json
 from datetime import datetime
 import pytz
+from xml.sax.saxutils import escape
 from config_manager import load_config, get_current_user, get_current_time_utc
+from gstin_lookup import cached_gstins
+from tally_scheduler import TallyScheduler, PRIORITY_INTERACTIVE, PRIORITY_FETCH, PRIORITY_WRITEBACK
 
 # Load configuration
 CONFIG = load_config()
 TALLY_URL = f"http://localhost:{CONFIG.get('TALLY', 'Port', fallback='9000')}"
+TALLY_COMPANY = CONFIG.get('TALLY', 'Company', fallback='') # Empty = whichever company is active in Tally
+SESSION = requests.Session() # Keep-alive connection pool to Tally (one per process)
+# Every Tally call goes through this scheduler (priorities, coalescing, budgets, adaptive throttling).
+# It coordinates with the schedulers of other processes (GUI, shard workers) talking to the same Tally.
+SCHEDULER = TallyScheduler(SESSION, max_busy_ratio=CONFIG.getfloat('TALLY', 'MaxBusyRatio', fallback=0.6),
+                           shared_dir=CONFIG.get('TALLY', 'SchedulerDir', fallback=None))
 CURRENT_USER = get_current_user()
 
-def check_tally_connection():
+def _company_variable():
+    """SVCURRENTCOMPANY element targeting TALLY_COMPANY, or nothing for the active company."""
+    return f"<SVCURRENTCOMPANY>{escape(TALLY_COMPANY)}</SVCURRENTCOMPANY>" if TALLY_COMPANY else ""
+
+def check_tally_connection(priority=PRIORITY_INTERACTIVE):
     """Basic connection check for Tally Prime."""
     try:
         # Use a simple request to check if Tally is reachable
@@ -32,7 +45,7 @@ def check_tally_connection():
         }
 
         print(f"Attempting to connect to Tally at: {TALLY_URL}")
-        response = requests.post(TALLY_URL, data=simple_request.encode('utf-8'), headers=headers, timeout=5)
+        response = SCHEDULER.post(TALLY_URL, simple_request.encode('utf-8'), headers, priority=priority, budget=5, coalesce=True)
 
         print(f"Connection Response Status: {response.status_code}")
         print(f"Connection Response: {response.text[:500]}")
@@ -43,32 +56,81 @@ def check_tally_connection():
         print(f"Connection Error: {str(e)}")
         return False
 
+# Custom collection exported instead of the built-in "Voucher Register" report.
+# Tally only serializes the FETCHed fields, and the filters run inside Tally, so vouchers that
+# update_tally_voucher marked Generated (UDF "VCH EInvoice Status" from listener.tdl) never leave the server.
+PENDING_COLLECTION_NAME = "EInvoice Pending Sales Vouchers"
+
 def get_pending_invoices_xml(from_date, to_date):
     """
-    Generate XML request for fetching sales vouchers from Tally Prime using predefined reports.
+    Generate XML request for fetching pending sales vouchers from Tally Prime via an inline TDL collection.
+    Only the fields read by parse_voucher_data are fetched.
     """
     xml_request = f"""<?xml version="1.0" encoding="UTF-8"?>
     <ENVELOPE>
         <HEADER>
             <VERSION>1</VERSION>
             <TALLYREQUEST>Export</TALLYREQUEST>
-            <TYPE>Data</TYPE>
-            <ID>Voucher Register</ID>
+            <TYPE>Collection</TYPE>
+            <ID>{PENDING_COLLECTION_NAME}</ID>
         </HEADER>
         <BODY>
             <DESC>
                 <STATICVARIABLES>
                     <SVFROMDATE>{from_date}</SVFROMDATE>
                     <SVTODATE>{to_date}</SVTODATE>
-                    <VOUCHERTYPENAME>Sales</VOUCHERTYPENAME>
-                    <EXPLODEFLAG>Yes</EXPLODEFLAG>
+                    <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
+                    {_company_variable()}
                 </STATICVARIABLES>
+                <TDL>
+                    <TDLMESSAGE>
+                        <COLLECTION NAME="{PENDING_COLLECTION_NAME}" ISMODIFY="No">
+                            <TYPE>Voucher</TYPE>
+                            <FETCH>GUID, MasterID, VoucherNumber, Date, PartyLedgerName, PartyGSTIN, StateName</FETCH>
+                            <FETCH>AllLedgerEntries.LedgerName, AllLedgerEntries.Amount, AllLedgerEntries.IsPartyLedger</FETCH>
+                            <FETCH>AllInventoryEntries.Amount</FETCH>
+                            <FILTER>EInvIsSalesVoucher, EInvIsNotGenerated</FILTER>
+                        </COLLECTION>
+                        <SYSTEM TYPE="Formulae" NAME="EInvIsSalesVoucher">$$IsSales:$VoucherTypeName AND NOT $IsCancelled</SYSTEM>
+                        <SYSTEM TYPE="Formulae" NAME="EInvIsNotGenerated">NOT ($VCHEInvoiceStatus = "Generated")</SYSTEM>
+                    </TDLMESSAGE>
+                </TDL>
             </DESC>
         </BODY>
     </ENVELOPE>
     """
     return xml_request
 
+def extract_vouchers(data_dict):
+    """
+    Return the list of VOUCHER dicts from a parsed Tally export.
+    Handles both collection exports (DATA/COLLECTION/VOUCHER) and report exports (DATA/TALLYMESSAGE/VOUCHER).
+    """
+    data = (data_dict.get('ENVELOPE') or {}).get('BODY', {}).get('DATA') or {}
+
+    collection = data.get('COLLECTION')
+    if collection is not None:
+        vouchers = (collection or {}).get('VOUCHER', [])
+    else:
+        messages = data.get('TALLYMESSAGE', [])
+        if not isinstance(messages, list):
+            messages = [messages]
+        vouchers = [m.get('VOUCHER', {}) for m in messages if isinstance(m, dict)]
+
+    if not isinstance(vouchers, list):
+        vouchers = [vouchers]
+    return vouchers
+
+def _text(value):
+    """
+    Leaf value of a parsed Tally element as a stripped string.
+    Collection exports emit typed leaves (<AMOUNT TYPE="Amount">), which xmltodict turns into
+    {'@TYPE': ..., '#text': ...}; plain report exports give the string directly.
+    """
+    if isinstance(value, dict):
+        value = value.get('#text')
+    return value.strip() if isinstance(value, str) else ''
+
 def parse_voucher_data(voucher):
     """
     Parse individual voucher data to extract required fields.
@@ -89,8 +151,8 @@ def parse_voucher_data(voucher):
         # Process ledger entries for tax and total amounts
         for entry in ledger_entries:
             if isinstance(entry, dict):
-                ledger_name = entry.get('LEDGERNAME', '').upper()
-                amount = abs(float(entry.get('AMOUNT', '0').replace('-', '') or 0))
+                ledger_name = _text(entry.get('LEDGERNAME')).upper()
+                amount = abs(float(_text(entry.get('AMOUNT')).replace('-', '') or 0))
 
                 if 'CGST' in ledger_name:
                     cgst_amount += amount
@@ -98,7 +160,7 @@ def parse_voucher_data(voucher):
                     sgst_amount += amount
                 elif 'IGST' in ledger_name:
                     igst_amount += amount
-                elif entry.get('ISPARTYLEDGER', 'No') == 'Yes':
+                elif _text(entry.get('ISPARTYLEDGER')) == 'Yes':
                     total_amount = amount  # Total amount is typically stored in the party ledger
 
         # Fetch Inventory Entries
@@ -108,18 +170,21 @@ def parse_voucher_data(voucher):
 
         for entry in inventory_entries:
             if isinstance(entry, dict):
-                taxable_amount += abs(float(entry.get('AMOUNT', '0') or 0))
+                taxable_amount += abs(float(_text(entry.get('AMOUNT')) or 0))
 
         # If taxable amount is 0, derive it from the total amount and taxes
         if taxable_amount == 0:
             taxable_amount = total_amount - (cgst_amount + sgst_amount + igst_amount)
 
         return {
-            'voucher_number': voucher.get('VOUCHERNUMBER', ''),
-            'date': voucher.get('DATE', ''),
-            'party_name': voucher.get('PARTYLEDGERNAME', ''),
-            'party_gstin': voucher.get('PARTYGSTIN', ''),
-            'destination': voucher.get('STATENAME', ''),
+            # Voucher GUID (REMOTEID attribute, or the fetched GUID field) - what write-back targets
+            'guid': (voucher.get('@REMOTEID') or _text(voucher.get('GUID'))).strip(),
+            'master_id': _text(voucher.get('MASTERID')),
+            'voucher_number': _text(voucher.get('VOUCHERNUMBER')),
+            'date': _text(voucher.get('DATE')),
+            'party_name': _text(voucher.get('PARTYLEDGERNAME')),
+            'party_gstin': _text(voucher.get('PARTYGSTIN')),
+            'destination': _text(voucher.get('STATENAME')),
             'taxable_amount': taxable_amount,
             'cgst_amount': cgst_amount,
             'sgst_amount': sgst_amount,
@@ -134,11 +199,15 @@ def parse_voucher_data(voucher):
         print(f"Error parsing voucher: {e}")
         return None
 
-def fetch_pending_invoices(from_date, to_date):
+def fetch_pending_invoices(from_date, to_date, priority=PRIORITY_FETCH):
     """
     Fetch and parse sales vouchers from Tally Prime.
+    Pass PRIORITY_INTERACTIVE for user-initiated fetches so they jump ahead of background work.
+    Identical fetches already queued or running are shared rather than re-sent.
+    gstin_status comes from the GSTIN cache only ('Unknown' if not looked up yet); this never
+    waits on the IRP - callers that need fresh lookups run gstin_lookup.prefetch_gstins themselves.
     """
-    if not check_tally_connection():
+    if not check_tally_connection(priority):
         raise ConnectionError(f"Tally is not running or not accessible at {TALLY_URL}")
 
     xml_payload = get_pending_invoices_xml(from_date, to_date)
@@ -147,7 +216,7 @@ def fetch_pending_invoices(from_date, to_date):
     try:
         print(f"Fetching invoices from {from_date} to {to_date}")
         print("Sending request to Tally...")
-        response = requests.post(TALLY_URL, data=xml_payload.encode('utf-8'), headers=headers, timeout=30)
+        response = SCHEDULER.post(TALLY_URL, xml_payload.encode('utf-8'), headers, priority=priority, budget=30, coalesce=True)
 
         print(f"Response Status: {response.status_code}")
         print(f"Response Content (first 500 chars): {response.text[:500]}")
@@ -158,19 +227,22 @@ def fetch_pending_invoices(from_date, to_date):
 
         # Parse XML response
         data_dict = xmltodict.parse(response.text)
-        envelope = data_dict.get('ENVELOPE', {})
-        body_data = envelope.get('BODY', {}).get('DATA', {}).get('TALLYMESSAGE', [])
-
-        if not isinstance(body_data, list):
-            body_data = [body_data]
 
         invoices = []
-        for entry in body_data:
-            voucher = entry.get('VOUCHER', {})
+        for voucher in extract_vouchers(data_dict):
             parsed_data = parse_voucher_data(voucher)
             if parsed_data:
                 invoices.append(parsed_data)
 
+        # Buyer status from the local GSTIN cache (memory/disk), one batch for the whole fetch
+        try:
+            gstin_info = cached_gstins(inv['party_gstin'] for inv in invoices if inv['party_gstin'])
+            for inv in invoices:
+                info = gstin_info.get((inv['party_gstin'] or '').strip().upper())
+                inv['gstin_status'] = ('Active' if info['valid'] else info['reason']) if info else 'Unknown'
+        except Exception as e:
+            print(f"GSTIN status lookup skipped: {e}")
+
         print(f"Successfully fetched {len(invoices)} invoices.")
         return invoices
 
@@ -178,17 +250,34 @@ def fetch_pending_invoices(from_date, to_date):
         print(f"Error during fetch: {e}")
         return []
 
-def update_tally_voucher(voucher_master_id, irn_data):
-    """Update voucher in Tally Prime with IRN details."""
-    if not check_tally_connection():
+# Voucher UDFs from listener.tdl: (UDF name, index, parse_response key). get_pending_invoices_xml
+# filters on "VCH EInvoice Status", so a voucher written back as Generated is never fetched again.
+EINVOICE_UDFS = [
+    ("VCH EInvoice IRN", 1001, 'irn'),
+    ("VCH EInvoice AckNo", 1002, 'ack_no'),
+    ("VCH EInvoice AckDate", 1003, 'ack_date'),
+    ("VCH EInvoice QRCode", 1004, 'qr_code'),
+    ("VCH EInvoice Status", 1005, 'status'),
+    ("VCH EInvoice Error", 1006, 'error_msg'),
+]
+
+def _udf(name, index, value):
+    """One String UDF in Tally's import layout; the tag is the UDF name without spaces."""
+    tag = name.replace(' ', '').upper()
+    return (f'<UDF:{tag}.LIST DESC="`{name}`" ISLIST="YES" TYPE="String" INDEX="{index}">'
+            f'<UDF:{tag} DESC="`{name}`">{escape(str(value or ""))}</UDF:{tag}>'
+            f'</UDF:{tag}.LIST>')
+
+def update_tally_voucher(voucher_guid, irn_data):
+    """
+    Update voucher in Tally Prime with IRN details (queued at write-back priority).
+    voucher_guid is the voucher's GUID ('guid' from parse_voucher_data): Tally matches an Alter on
+    REMOTEID, which is the GUID - not the MasterID.
+    """
+    if not check_tally_connection(PRIORITY_WRITEBACK):
         return False, "Tally is not connected"
 
-    irn = irn_data.get('irn', '') or ''
-    ack_no = irn_data.get('ack_no', '') or ''
-    ack_date = irn_data.get('ack_date', '') or ''
-    status = irn_data.get('status', '') or ''
-    error_msg = irn_data.get('error_msg', '') or ''
-
+    values = dict(irn_data, error_msg=(irn_data.get('error_msg') or '')[:500])
     xml_request = f"""<?xml version="1.0" encoding="UTF-8"?>
     <ENVELOPE>
         <HEADER>
@@ -202,22 +291,13 @@ def update_tally_voucher(voucher_master_id, irn_data):
                 <STATICVARIABLES>
                     <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
                     <IMPORTDUPS>@@DUPIGNORE</IMPORTDUPS>
+                    {_company_variable()}
                 </STATICVARIABLES>
             </DESC>
             <DATA>
                 <TALLYMESSAGE>
-                    <VOUCHER REMOTEID="{voucher_master_id}" VCHTYPE="Sales" ACTION="Alter">
-                        <MASTERID>{voucher_master_id}</MASTERID>
-                        <ALTERID>{voucher_master_id}</ALTERID>
-                        <ALLLEDGERENTRIES.LIST>
-                            <EINVOICEDETAILS.LIST>
-                                <IRN>{irn}</IRN>
-                                <ACKNO>{ack_no}</ACKNO>
-                                <ACKDT>{ack_date}</ACKDT>
-                                <STATUS>{status}</STATUS>
-                                <ERRORMSG>{error_msg[:500]}</ERRORMSG>
-                            </EINVOICEDETAILS.LIST>
-                        </ALLLEDGERENTRIES.LIST>
+                    <VOUCHER REMOTEID="{escape(voucher_guid, {'"': '&quot;'})}" VCHTYPE="Sales" ACTION="Alter">
+                        {"".join(_udf(name, index, values.get(key)) for name, index, key in EINVOICE_UDFS)}
                         <UPDATEDBY>{CURRENT_USER}</UPDATEDBY>
                         <UPDATEDATE>{datetime.now(pytz.UTC).strftime('%Y%m%d')}</UPDATEDATE>
                     </VOUCHER>
@@ -230,13 +310,13 @@ def update_tally_voucher(voucher_master_id, irn_data):
     headers = {'Content-Type': 'text/xml;charset=utf-8', 'Accept': '*/*'}
 
     try:
-        print(f"Updating voucher {voucher_master_id} in Tally...")
-        response = requests.post(
-            TALLY_URL, 
-            data=xml_request.encode('utf-8'), 
-            headers=headers,
-            timeout=30,
-            verify=False
+        print(f"Updating voucher {voucher_guid} in Tally...")
+        response = SCHEDULER.post(
+            TALLY_URL,
+            xml_request.encode('utf-8'),
+            headers,
+            priority=PRIORITY_WRITEBACK,
+            budget=30
         )
         
         if response.status_code == 200:
@@ -0,0 +1,326 @@
+# tally_scheduler.py
+#
+# Tally Prime's XML server handles one request at a time. Every call from tally_connector
+# goes through one TallyScheduler, which:
+# - dispatches one request at a time, highest priority first (interactive > fetch > write-back)
+# - coalesces identical exports so duplicate fetches share a single request/response
+# - gives every request a time budget covering both queue wait and the HTTP call
+# - leaves idle gaps after background requests, sized from measured Tally response
+#   times, so Tally stays responsive for the people using it. Interactive requests can
+#   still run during those gaps.
+#
+# Every process talking to Tally (the GUI, each shard worker) has its own scheduler, so the
+# rules above are enforced across processes through an endpoint gate: small lock/state files
+# per Tally URL in a shared directory (TALLY_SCHEDULER_DIR, [TALLY] SchedulerDir, or the temp
+# directory). Only one request per endpoint is in flight machine-wide, the response-time average
+# and idle gap are shared, and background requests yield to more urgent requests waiting in
+# other processes. Processes on other machines are not coordinated.
+
+import os
+import json
+import time
+import heapq
+import hashlib
+import tempfile
+import itertools
+import threading
+import contextlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+try:
+    import msvcrt  # Windows
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_FETCH = 1
+PRIORITY_WRITEBACK = 2
+
+
+class _Job:
+    __slots__ = ('url', 'data', 'headers', 'priority', 'deadline', 'key', 'future', 'started', 'waiters')
+
+    def __init__(self, url, data, headers, priority, deadline, key):
+        self.url = url
+        self.data = data
+        self.headers = headers
+        self.priority = priority
+        self.deadline = deadline
+        self.key = key
+        self.future = Future()
+        self.started = False
+        self.waiters = 1  # Callers sharing this job through coalescing
+
+
+def _try_lock(f):
+    """Non-blocking exclusive lock on an open file; True if acquired. Held per open file, not per process."""
+    try:
+        if msvcrt:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if msvcrt:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class _EndpointGate:
+    """
+    Cross-process access to one Tally endpoint. <key>.lock is held for the duration of a request;
+    <key>.state holds the shared response-time average, the next background slot and the
+    requests waiting in every process. A crashed process's lock is released by the OS and its
+    waiter entry expires once it stops being refreshed.
+    """
+
+    POLL_INTERVAL = 0.02
+    WAITER_STALE_AFTER = 1.0  # Waiters refresh their entry every poll
+
+    def __init__(self, url, directory):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, hashlib.sha1(url.encode('utf-8')).hexdigest()[:16])
+        self._lock_file = self._open(base + '.lock')
+        self._state_file = self._open(base + '.state')
+        self._id = f"{os.getpid()}-{id(self)}"
+
+    @staticmethod
+    def _open(path):
+        open(path, 'ab').close()
+        return open(path, 'r+b')
+
+    @contextlib.contextmanager
+    def state(self):
+        """Locked read-modify-write of the shared state dict."""
+        f = self._state_file
+        while not _try_lock(f):
+            time.sleep(0.001)
+        try:
+            f.seek(0)
+            raw = f.read()
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state).encode('utf-8'))
+            f.flush()
+        finally:
+            _unlock(f)
+
+    def acquire(self, priority, deadline, preempted):
+        """
+        Wait until this process may send a request of `priority`: no more urgent request is waiting
+        in another process, the shared idle gap has passed (background only) and no other request is
+        in flight. Returns True holding the endpoint, or False once the deadline passes or
+        preempted() is true.
+        """
+        acquired = False
+        try:
+            while True:
+                now = time.time()
+                with self.state() as state:
+                    waiters = {k: w for k, w in state.get('waiters', {}).items()
+                               if w[1] > now and w[2] > now - self.WAITER_STALE_AFTER}
+                    waiters[self._id] = [priority, deadline, now]
+                    state['waiters'] = waiters
+                    blocked = any(w[0] < priority for k, w in waiters.items() if k != self._id)
+                    if priority > PRIORITY_INTERACTIVE and state.get('ready_at', 0.0) > now:
+                        blocked = True
+                    if not blocked and _try_lock(self._lock_file):
+                        del waiters[self._id]
+                        acquired = True
+                        return True
+                if now >= deadline or preempted():
+                    return False
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            if not acquired:
+                with self.state() as state:
+                    state.get('waiters', {}).pop(self._id, None)
+
+    def release(self):
+        _unlock(self._lock_file)
+
+
+class TallyScheduler:
+    """Single-dispatcher, priority-ordered request queue in front of Tally XML servers."""
+
+    def __init__(self, session, max_busy_ratio=0.6, max_gap=5.0, smoothing=0.3, shared_dir=None):
+        self.session = session
+        # Fraction of wall time background work may keep Tally busy (0 < ratio <= 1)
+        self.max_busy_ratio = min(max(max_busy_ratio, 0.05), 1.0)
+        self.max_gap = max_gap
+        self.smoothing = smoothing
+        self.avg_response_time = None  # EWMA of Tally response times, seconds (shared per endpoint)
+        self.shared_dir = (shared_dir or os.environ.get('TALLY_SCHEDULER_DIR')
+                           or os.path.join(tempfile.gettempdir(), 'einvoice-tally'))
+        self._gates = {}  # Tally URL -> _EndpointGate, used by the dispatcher thread only
+        self._heap = []
+        self._seq = itertools.count()
+        self._pending = {}  # coalescing key -> queued or running job
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # --- Public API ---
+    def submit(self, url, data, headers, priority=PRIORITY_FETCH, budget=30.0, coalesce=False):
+        """
+        Queue a POST to Tally and return a Future resolving to the requests.Response.
+        With coalesce=True an identical queued/running request is reused instead of sending another.
+        The Future fails with TimeoutError if the budget runs out before the request can start.
+        """
+        return self._enqueue(url, data, headers, priority, budget, coalesce).future
+
+    def post(self, url, data, headers, priority=PRIORITY_FETCH, budget=30.0, coalesce=False):
+        """
+        Blocking submit(); returns the Response or raises the request's exception.
+        Never waits longer than the budget: on expiry the caller is detached and TimeoutError is raised.
+        """
+        job = self._enqueue(url, data, headers, priority, budget, coalesce)
+        try:
+            return job.future.result(timeout=budget)
+        except FutureTimeoutError:
+            self._detach(job)
+            raise TimeoutError(f"Tally request budget of {budget}s expired") from None
+
+    # --- Queue ---
+    def _enqueue(self, url, data, headers, priority, budget, coalesce):
+        deadline = time.time() + budget  # Wall clock: deadlines are compared across processes
+        key = (url, data) if coalesce else None
+        with self._cond:
+            self._ensure_dispatcher()
+            job = self._pending.get(key) if key else None
+            if job is not None:
+                job.deadline = max(job.deadline, deadline)
+                job.waiters += 1
+                if priority < job.priority and not job.started:
+                    # Promote the shared request; the stale heap entry is skipped when popped
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+                    self._cond.notify()
+                print(f"Coalesced duplicate Tally request (priority {priority}) into in-flight request")
+                return job
+
+            job = _Job(url, data, headers, priority, deadline, key)
+            if key:
+                self._pending[key] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+            return job
+
+    def _detach(self, job):
+        """
+        Drop one waiter from a job whose caller gave up. A queued job nobody waits for any more is
+        cancelled so it never reaches Tally; a running one completes and its response is discarded.
+        """
+        with self._cond:
+            job.waiters -= 1
+            if job.waiters <= 0 and not job.started:
+                job.future.cancel()  # Skipped by the dispatcher when popped
+                if job.key and self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+
+    # --- Dispatcher ---
+    def _ensure_dispatcher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="tally-scheduler", daemon=True)
+            self._thread.start()
+
+    def _prune(self):
+        """Drop heap entries for jobs that started, were cancelled or were promoted; condition held."""
+        while self._heap and (self._heap[0][2].started or self._heap[0][2].future.cancelled()
+                              or self._heap[0][0] != self._heap[0][2].priority):
+            heapq.heappop(self._heap)
+
+    def _next_job(self):
+        """Block until a job is queued and return the most urgent one; called with the condition held."""
+        while True:
+            self._prune()
+            if not self._heap:
+                self._cond.wait()
+                continue
+            job = heapq.heappop(self._heap)[2]
+            job.started = True
+            return job
+
+    def _outranked(self, job):
+        """True when a more urgent job was queued in this process while `job` waits for the endpoint."""
+        with self._cond:
+            self._prune()
+            return bool(self._heap) and self._heap[0][0] < job.priority
+
+    def _gate(self, url):
+        if url not in self._gates:
+            self._gates[url] = _EndpointGate(url, self.shared_dir)
+        return self._gates[url]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+
+            gate = self._gate(job.url)
+            if not gate.acquire(job.priority, job.deadline, lambda: self._outranked(job)):
+                if time.time() >= job.deadline:
+                    self._finish(job, exc=TimeoutError("Tally request budget expired while queued"))
+                else:
+                    with self._cond:  # Preempted: the more urgent job goes first, this one waits again
+                        job.started = False
+                        if job.waiters <= 0:
+                            job.future.cancel()  # Every caller gave up while it waited for the endpoint
+                            if job.key and self._pending.get(job.key) is job:
+                                del self._pending[job.key]
+                        else:
+                            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+                continue
+
+            remaining = job.deadline - time.time()
+            if remaining <= 0:
+                gate.release()
+                self._finish(job, exc=TimeoutError("Tally request budget expired while queued"))
+                continue
+
+            start = time.monotonic()
+            try:
+                response = self.session.post(job.url, data=job.data, headers=job.headers, timeout=remaining)
+            except Exception as e:
+                self._record(gate, time.monotonic() - start, job.priority)
+                self._finish(job, exc=e)
+            else:
+                self._record(gate, time.monotonic() - start, job.priority)
+                self._finish(job, result=response)
+
+    def _record(self, gate, elapsed, priority):
+        """Update the shared response-time average and next background slot, then free the endpoint."""
+        try:
+            with gate.state() as state:
+                avg = state.get('avg')
+                avg = elapsed if avg is None else avg + self.smoothing * (elapsed - avg)
+                state['avg'] = self.avg_response_time = avg
+                if priority > PRIORITY_INTERACTIVE:
+                    # Busy for `elapsed`, so idle for elapsed * (1 - r) / r to hold the busy ratio at r.
+                    # Use the larger of this and the average so one fast reply does not drop the gap.
+                    busy = max(elapsed, avg)
+                    gap = min(busy * (1 - self.max_busy_ratio) / self.max_busy_ratio, self.max_gap)
+                    state['ready_at'] = time.time() + gap
+        finally:
+            gate.release()
+
+    def _finish(self, job, result=None, exc=None):
+        with self._cond:
+            if job.key and self._pending.get(job.key) is job:
+                del self._pending[job.key]
+        if exc is not None:
+            job.future.set_exception(exc)
+        else:
+            job.future.set_result(result)
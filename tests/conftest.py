@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the GSTIN disk cache and the Tally scheduler's shared state out of the working tree / real temp dir
+_TMP = tempfile.mkdtemp(prefix='einv-tests-')
+os.environ.setdefault('GSTIN_CACHE_PATH', os.path.join(_TMP, 'gstin_cache.db'))
+os.environ.setdefault('TALLY_SCHEDULER_DIR', os.path.join(_TMP, 'tally-scheduler'))
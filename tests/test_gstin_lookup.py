@@ -0,0 +1,112 @@
+import json
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import gstin_lookup
+
+ACTIVE = "29AAACA1234A1Z5"
+UNKNOWN = "07AAACA1234A1Z5"
+
+
+@pytest.fixture
+def fake_irp(monkeypatch):
+    """Replace irn_generator.get_gstin_details with a recording fake."""
+    calls = []
+
+    def get_gstin_details(gstin):
+        calls.append(gstin)
+        if gstin == UNKNOWN:
+            return {"Status": 0, "ErrorDetails": [{"ErrorCode": "3028", "ErrorMessage": "GSTIN not present"}]}
+        return {"Status": 1, "Data": {"LegalName": "ACME", "AddrBno": "12", "AddrLoc": "Bengaluru",
+                                      "AddrPncd": "560001", "StateCode": 29, "Status": "ACT"}}
+
+    fake = types.SimpleNamespace(get_gstin_details=get_gstin_details, ensure_authenticated=lambda: True)
+    monkeypatch.setitem(sys.modules, "irn_generator", fake)
+    gstin_lookup.clear_cache(disk=True)
+    yield calls
+    gstin_lookup.clear_cache(disk=True)
+
+
+def test_prefetch_deduplicates_and_caches_negatives(fake_irp):
+    results = gstin_lookup.prefetch_gstins([ACTIVE, UNKNOWN, ACTIVE.lower(), "bad"])
+    assert sorted(fake_irp) == [UNKNOWN, ACTIVE]
+    assert results[ACTIVE]["valid"] and results[ACTIVE]["details"]["Stcd"] == "29"
+    assert not results[UNKNOWN]["valid"] and "3028" in results[UNKNOWN]["reason"]
+    assert results["BAD"]["reason"] == "Invalid GSTIN format"
+
+    # Memory miss falls through to the disk cache, not the IRP
+    gstin_lookup.clear_cache()
+    assert not gstin_lookup.lookup_gstin(UNKNOWN)["valid"]
+    assert gstin_lookup.lookup_gstin(ACTIVE)["details"]["LglNm"] == "ACME"
+    assert len(fake_irp) == 2
+
+
+def test_missing_state_code_stays_empty():
+    assert gstin_lookup._normalize_details({"LegalName": "X"})["Stcd"] == ""
+    assert gstin_lookup._normalize_details({"StateCode": 7})["Stcd"] == "07"
+
+
+def test_prefetch_survives_irp_import_failure(monkeypatch):
+    gstin_lookup.clear_cache(disk=True)
+    monkeypatch.setitem(sys.modules, "irn_generator", None)  # makes `import irn_generator` raise ImportError
+    results = gstin_lookup.prefetch_gstins([ACTIVE, "bad"])
+    assert list(results) == ["BAD"]  # Unresolvable GSTINs are simply absent
+
+
+def test_cached_gstins_never_calls_irp(fake_irp):
+    gstin_lookup.prefetch_gstins([ACTIVE])
+    assert set(gstin_lookup.cached_gstins([ACTIVE, UNKNOWN])) == {ACTIVE}
+    assert fake_irp == [ACTIVE]
+
+
+def test_irp_lookups_go_through_throttle(fake_irp, monkeypatch):
+    throttled = []
+    monkeypatch.setattr(gstin_lookup, "THROTTLE", lambda: throttled.append(1))
+    gstin_lookup.prefetch_gstins([ACTIVE, UNKNOWN])
+    gstin_lookup.prefetch_gstins([ACTIVE, UNKNOWN])  # cache hits are not throttled
+    assert len(throttled) == len(fake_irp) == 2
+
+
+class _Reply:
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def test_concurrent_prefetch_authenticates_once(monkeypatch):
+    import irn_generator
+
+    auths = []
+    lock = threading.Lock()
+
+    def authenticate_irp():
+        with lock:
+            auths.append(1)
+        time.sleep(0.05)  # a slow AUTH call widens any race between pool threads
+        irn_generator.IRP_AUTH_TOKEN, irn_generator.SEK = "token", b"0" * 32
+        return True
+
+    def get(url, **kwargs):
+        return _Reply({"Status": 1, "Data": {"LegalName": "ACME", "StateCode": 29, "Status": "ACT"}})
+
+    monkeypatch.setattr(irn_generator, "IRP_AUTH_TOKEN", None)
+    monkeypatch.setattr(irn_generator, "SEK", None)
+    monkeypatch.setattr(irn_generator, "authenticate_irp", authenticate_irp)
+    monkeypatch.setattr(irn_generator.SESSION, "get", get)
+    gstin_lookup.clear_cache(disk=True)
+    try:
+        gstins = [f"29AAACA{1000 + i}A1Z5" for i in range(8)]
+        results = gstin_lookup.prefetch_gstins(gstins)
+    finally:
+        gstin_lookup.clear_cache(disk=True)
+    assert len(auths) == 1
+    assert all(results[g]["valid"] for g in gstins)
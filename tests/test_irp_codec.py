@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+import gstin_lookup
+import irp_codec
+
+BUYER = "07AAACB5678B1Z2"
+
+
+def test_canonicalize_orders_drops_and_rounds():
+    payload = {"ValDtls": {"TotInvVal": 5900.004, "AssVal": 5000.0}, "Version": "1.1",
+               "ItemList": [{"TotItemVal": 1.0, "Qty": 2.00049, "SlNo": "1", "BchDtls": {}, "Zz": "x"}],
+               "DocDtls": {"Dt": "01/04/2025", "No": "INV/1", "Typ": "INV"},
+               "TranDtls": {"TaxSch": "GST", "RegRev": None, "IgstOnIntra": ""}}
+    assert irp_codec.encode_payload(payload) == (
+        '{"Version":"1.1","TranDtls":{"TaxSch":"GST"},"DocDtls":{"Typ":"INV","No":"INV/1","Dt":"01/04/2025"},'
+        '"ItemList":[{"SlNo":"1","Qty":2.0,"TotItemVal":1.0,"Zz":"x"}],"ValDtls":{"AssVal":5000.0,"TotInvVal":5900.0}}')
+
+
+@pytest.mark.parametrize("backend", list(irp_codec.BACKENDS))
+def test_envelope_round_trip(backend):
+    irp_codec.use_backend(backend)
+    try:
+        payload = {"Version": "1.1", "DocDtls": {"Typ": "INV", "No": "INV/1", "Dt": "01/04/2025"}}
+        assert irp_codec.decode_envelope(irp_codec.encode_envelope(irp_codec.encode_payload(payload))) == payload
+    finally:
+        irp_codec.use_backend("orjson" if "orjson" in irp_codec.BACKENDS else "json")
+
+
+def test_canonicalize_sorts_only_out_of_order_sections():
+    in_order = {"Version": "1.1", "DocDtls": {"Typ": "INV", "No": "INV/1", "Dt": "01/04/2025"}}
+    assert list(irp_codec.canonicalize(in_order)) == ["Version", "DocDtls"]
+    # Two unknown keys tie on rank and still come out alphabetically after the schema keys
+    shuffled = {"DocDtls": {"Zb": 1, "Za": 2, "Dt": "01/04/2025", "Typ": "INV"}, "Version": "1.1"}
+    canonical = irp_codec.canonicalize(shuffled)
+    assert list(canonical) == ["Version", "DocDtls"]
+    assert list(canonical["DocDtls"]) == ["Typ", "Dt", "Za", "Zb"]
+
+
+def test_canonicalize_rounds_only_known_numeric_fields():
+    payload = {"ItemList": [{"Qty": 1.23456, "GstRt": 18.0004, "IgstAmt": 10.005001, "Zz": 0.123456}]}
+    assert irp_codec.canonicalize(payload)["ItemList"] == [
+        {"Qty": 1.235, "GstRt": 18.0, "IgstAmt": 10.01, "Zz": 0.123456}]
+
+
+def test_format_invoice_json_sends_canonical_payload(monkeypatch):
+    """format_invoice_json canonicalizes: empty optionals dropped and precision applied whatever it builds."""
+    import irn_generator
+
+    gstin_lookup._remember({'gstin': BUYER, 'valid': True, 'reason': '', 'fetched_at': time.time(),
+                            'details': {'LglNm': 'Buyer Pvt Ltd', 'Addr1': '22', 'Loc': 'New Delhi',
+                                        'Pin': 110001, 'Stcd': '07'}})
+    encoded = []
+    monkeypatch.setattr(irp_codec, "encode_envelope", lambda data: encoded.append(data) or data)
+    invoice = {'voucher_number': "INV/1", 'party_name': "Buyer", 'party_gstin': BUYER}
+    irn_generator.format_invoice_json(invoice)
+    payload = irp_codec.loads(encoded[0])
+    assert encoded[0] == irp_codec.dumps(irp_codec.canonicalize(payload))
+    assert list(payload)[:3] == ["Version", "TranDtls", "DocDtls"]
+    assert payload["DocDtls"]["No"] == "INV/1"
@@ -0,0 +1,35 @@
+import os
+import zipfile
+
+import pytest
+
+import print_renderer
+
+IRN = "ab" + "c" * 62
+INVOICE = {'irn': IRN, 'qr_code': "signed-qr-payload", 'ack_no': 112010000000001,
+           'ack_date': "2025-04-01 10:00:00", 'voucher_number': "INV/1"}
+
+
+def test_render_batch_writes_artifacts_once(tmp_path):
+    out = str(tmp_path)
+    assert print_renderer.render_batch([INVOICE, dict(INVOICE), {'irn': '', 'qr_code': 'x'}], out) == \
+        {IRN: print_renderer.artifact_dir(IRN, out)}
+    assert print_renderer.is_rendered(IRN, out)
+    with open(os.path.join(print_renderer.artifact_dir(IRN, out), 'summary.txt'), encoding='utf-8') as f:
+        assert "Invoice  : INV/1" in f.read()
+
+    zip_path = str(tmp_path / "print.zip")
+    assert print_renderer.export_artifacts([IRN, "missing"], zip_path, out) == 1
+    with zipfile.ZipFile(zip_path) as zf:
+        assert sorted(zf.namelist()) == [f"{IRN}/qr.png", f"{IRN}/qr.svg", f"{IRN}/summary.txt"]
+
+
+def test_failed_render_leaves_no_partial_output(tmp_path, monkeypatch):
+    def broken_summary(invoice):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(print_renderer, 'format_summary_block', broken_summary)
+    with pytest.raises(OSError):
+        print_renderer._render_one(INVOICE, str(tmp_path))
+    assert os.listdir(tmp_path / IRN[:2]) == []
+    assert not print_renderer.is_rendered(IRN, str(tmp_path))
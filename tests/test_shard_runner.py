@@ -0,0 +1,143 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import shard_runner
+
+SELLER_GSTIN = "29AAACA1234A1Z5"
+BUYER_GSTIN = "07AAACB5678B1Z2"
+
+PENDING_EXPORT = f"""<ENVELOPE><HEADER><VERSION>1</VERSION><STATUS>1</STATUS></HEADER><BODY><DATA><COLLECTION>
+<VOUCHER REMOTEID="guid-1" VCHTYPE="Sales"><MASTERID TYPE="Number"> 42</MASTERID><VOUCHERNUMBER TYPE="String">INV/1</VOUCHERNUMBER>
+ <PARTYLEDGERNAME TYPE="String">Buyer</PARTYLEDGERNAME><PARTYGSTIN TYPE="String">{BUYER_GSTIN}</PARTYGSTIN>
+ <ALLLEDGERENTRIES.LIST><LEDGERNAME TYPE="String">Buyer</LEDGERNAME><ISPARTYLEDGER TYPE="Logical">Yes</ISPARTYLEDGER>
+  <AMOUNT TYPE="Amount">-118.00</AMOUNT></ALLLEDGERENTRIES.LIST>
+ <ALLLEDGERENTRIES.LIST><LEDGERNAME TYPE="String">Output IGST 18%</LEDGERNAME><AMOUNT TYPE="Amount">18.00</AMOUNT></ALLLEDGERENTRIES.LIST>
+</VOUCHER>
+<VOUCHER VCHTYPE="Sales"><VOUCHERNUMBER TYPE="String">INV/2</VOUCHERNUMBER>
+ <PARTYLEDGERNAME TYPE="String">Buyer</PARTYLEDGERNAME><PARTYGSTIN TYPE="String">{BUYER_GSTIN}</PARTYGSTIN>
+ <ALLLEDGERENTRIES.LIST><LEDGERNAME TYPE="String">Buyer</LEDGERNAME><ISPARTYLEDGER TYPE="Logical">Yes</ISPARTYLEDGER>
+  <AMOUNT TYPE="Amount">-59.00</AMOUNT></ALLLEDGERENTRIES.LIST>
+</VOUCHER>
+</COLLECTION></DATA></BODY></ENVELOPE>"""
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Plays both Tally (/tally) and the IRP (/ewaybillapi/...)."""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if "/master/gstin/" in self.path:
+            self._reply(json.dumps({"Status": 1, "Data": {
+                "LegalName": "Buyer Pvt Ltd", "AddrBno": "22", "AddrLoc": "New Delhi",
+                "AddrPncd": "110001", "StateCode": "07", "Status": "ACT"}}))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        self.server.requests.append((self.path, body))
+        if self.path.startswith("/tally"):
+            with self.server.lock:
+                self.server.tally_in_flight += 1
+                self.server.max_tally_in_flight = max(self.server.max_tally_in_flight, self.server.tally_in_flight)
+            time.sleep(0.02)  # Tally's single request thread is busy; overlapping callers would show up here
+            with self.server.lock:
+                self.server.tally_in_flight -= 1
+            if "<TALLYREQUEST>Import</TALLYREQUEST>" in body:
+                # Like Tally, alter only a voucher whose REMOTEID (GUID) exists in the company
+                if re.search(r'<VOUCHER REMOTEID="guid-1"', body):
+                    self._reply("<RESPONSE><ALTERED>1</ALTERED></RESPONSE>", "text/xml")
+                else:
+                    self._reply("<RESPONSE><LINEERROR>Voucher not found</LINEERROR></RESPONSE>", "text/xml")
+            elif "EInvoice Pending Sales Vouchers" in body:
+                self._reply(PENDING_EXPORT, "text/xml")
+            else:
+                self._reply("<ENVELOPE></ENVELOPE>", "text/xml")
+        elif self.path.endswith("/auth"):
+            self._reply(json.dumps({"Status": 1, "Data": {"AuthToken": "tok", "Sek": "sek", "TokenExpiry": 360}}))
+        else:
+            self._reply(json.dumps({"Status": 1, "Data": {
+                "Irn": "a" * 64, "AckNo": 112010000000001, "AckDt": "2025-04-01 10:00:00", "SignedQRCode": "qr"}}))
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+    server.tally_in_flight = server.max_tally_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    # Inherited by the spawned shard worker
+    monkeypatch.setenv("IRP_SANDBOX_URL", base)
+    monkeypatch.setenv("IRP_MODE", "SANDBOX")
+    monkeypatch.setenv("IRP_API_USERNAME", "stub-user")
+    monkeypatch.setenv("IRP_API_PASSWORD", "stub-pass")
+    yield server, base
+    server.shutdown()
+
+
+def test_single_shard_runs_end_to_end(stub_server, tmp_path):
+    server, base = stub_server
+    shard = {'name': 'north', 'tally_url': f"{base}/tally", 'company': 'ABC Traders', 'user_gstin': SELLER_GSTIN,
+             'requests_per_minute': 0, 'credentials_prefix': ''}
+    progress = []
+
+    results = shard_runner.run_sharded("01-04-2025", "30-04-2025", [shard],
+                                       on_progress=lambda *p: progress.append(p),
+                                       output_dir=str(tmp_path))
+
+    summary = results['north']
+    assert (summary['fetched'], summary['generated'], summary['failed']) == (2, 2, 0)
+    assert progress[-1] == ('north', 2, 2)
+    # INV/2 has no GUID: reported, never written back under its voucher number or MasterID
+    assert summary['errors'] == ["INV/2: write-back skipped: voucher GUID missing from Tally export"]
+
+    imports = [body for path, body in server.requests if "<TALLYREQUEST>Import</TALLYREQUEST>" in body]
+    assert len(imports) == 1
+    assert '<VOUCHER REMOTEID="guid-1"' in imports[0] and "a" * 64 in imports[0]
+    assert '<UDF:VCHEINVOICESTATUS DESC="`VCH EInvoice Status`">Generated<' in imports[0]
+    assert "<SVCURRENTCOMPANY>ABC Traders</SVCURRENTCOMPANY>" in imports[0]
+    generate = [body for path, body in server.requests if path.endswith("/invoice")]
+    assert len(generate) == 2 and SELLER_GSTIN in generate[0]
+
+    # Print stage ran in the supervisor for the generated invoices
+    irn = "a" * 64
+    assert summary['artifacts'] == {irn: str(tmp_path / "aa" / irn)}
+    assert sorted(p.name for p in (tmp_path / "aa" / irn).iterdir()) == ["qr.png", "qr.svg", "summary.txt"]
+
+
+def test_shards_sharing_a_tally_never_overlap_requests(stub_server, tmp_path):
+    server, base = stub_server
+    shards = [{'name': name, 'tally_url': f"{base}/tally", 'company': 'ABC Traders', 'user_gstin': SELLER_GSTIN,
+               'requests_per_minute': 0, 'credentials_prefix': ''} for name in ('north', 'south')]
+
+    results = shard_runner.run_sharded("01-04-2025", "30-04-2025", shards, render_artifacts=False)
+
+    assert [results[name]['generated'] for name in ('north', 'south')] == [2, 2]
+    # Separate worker processes, one Tally: their schedulers share the endpoint gate
+    assert server.max_tally_in_flight == 1
+
+
+def test_prefixed_shard_without_credentials_fails(monkeypatch):
+    monkeypatch.delenv("NORTH_IRP_API_USERNAME", raising=False)
+    monkeypatch.setenv("NORTH_IRP_API_PASSWORD", "secret")
+    monkeypatch.setenv("IRP_API_USERNAME", "other-registration")
+    shard = {'name': 'north', 'tally_url': "http://127.0.0.1:9", 'company': '', 'user_gstin': SELLER_GSTIN,
+             'requests_per_minute': 0, 'credentials_prefix': 'NORTH'}
+    with pytest.raises(ValueError, match="NORTH_IRP_API_USERNAME"):
+        shard_runner._configure_worker(shard)
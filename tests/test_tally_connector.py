@@ -0,0 +1,156 @@
+import re
+
+import pytest
+import xmltodict
+
+import gstin_lookup
+import tally_connector
+from tally_connector import extract_vouchers, parse_voucher_data
+from tally_scheduler import TallyScheduler, PRIORITY_INTERACTIVE
+
+# Shape of a real TYPE=Collection export: typed leaves, padded MASTERID, voucher attributes
+COLLECTION_EXPORT = """<ENVELOPE><HEADER><VERSION>1</VERSION><STATUS>1</STATUS></HEADER><BODY><DESC></DESC><DATA>
+<COLLECTION>
+ <VOUCHER REMOTEID="abc-1" VCHKEY="abc-1:0001" VCHTYPE="Sales" ACTION="Create" OBJVIEW="Invoice Voucher View">
+  <MASTERID TYPE="Number">     42</MASTERID>
+  <VOUCHERNUMBER TYPE="String">INV/1</VOUCHERNUMBER>
+  <DATE TYPE="Date">20250401</DATE>
+  <PARTYLEDGERNAME TYPE="String">ACME Pvt Ltd</PARTYLEDGERNAME>
+  <PARTYGSTIN TYPE="String">07AAACA1234A1Z5</PARTYGSTIN>
+  <STATENAME TYPE="String">Delhi</STATENAME>
+  <ALLLEDGERENTRIES.LIST>
+   <LEDGERNAME TYPE="String">ACME Pvt Ltd</LEDGERNAME>
+   <ISPARTYLEDGER TYPE="Logical">Yes</ISPARTYLEDGER>
+   <AMOUNT TYPE="Amount">-1180.00</AMOUNT>
+  </ALLLEDGERENTRIES.LIST>
+  <ALLLEDGERENTRIES.LIST>
+   <LEDGERNAME TYPE="String">Output IGST 18%</LEDGERNAME>
+   <ISPARTYLEDGER TYPE="Logical">No</ISPARTYLEDGER>
+   <AMOUNT TYPE="Amount">180.00</AMOUNT>
+  </ALLLEDGERENTRIES.LIST>
+  <ALLINVENTORYENTRIES.LIST>
+   <AMOUNT TYPE="Amount">1000.00</AMOUNT>
+  </ALLINVENTORYENTRIES.LIST>
+ </VOUCHER>
+</COLLECTION></DATA></BODY></ENVELOPE>"""
+
+
+def test_typed_collection_voucher_is_parsed():
+    vouchers = extract_vouchers(xmltodict.parse(COLLECTION_EXPORT))
+    assert len(vouchers) == 1
+    invoice = parse_voucher_data(vouchers[0])
+    assert invoice is not None
+    assert invoice['master_id'] == '42'
+    assert invoice['guid'] == 'abc-1'
+    assert invoice['voucher_number'] == 'INV/1'
+    assert invoice['party_gstin'] == '07AAACA1234A1Z5'
+    assert (invoice['total_amount'], invoice['igst_amount'], invoice['taxable_amount']) == (1180.0, 180.0, 1000.0)
+
+
+def test_untyped_report_voucher_still_parsed():
+    report = COLLECTION_EXPORT.replace("<COLLECTION>", "<TALLYMESSAGE>").replace("</COLLECTION>", "</TALLYMESSAGE>")
+    for tag in ('TYPE="Number"', 'TYPE="String"', 'TYPE="Date"', 'TYPE="Logical"', 'TYPE="Amount"'):
+        report = report.replace(" " + tag, "")
+    invoice = parse_voucher_data(extract_vouchers(xmltodict.parse(report))[0])
+    assert invoice['master_id'] == '42' and invoice['total_amount'] == 1180.0
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeTally:
+    """
+    In-memory Tally company: answers the pending collection export by evaluating its
+    "not generated" filter against the voucher UDFs, and applies UDF values from imports.
+    """
+
+    def __init__(self, export_xml):
+        self.vouchers = extract_vouchers(xmltodict.parse(export_xml))
+        self.udfs = {}  # REMOTEID (voucher GUID) -> {UDF tag: value}
+        self.imports = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        body = data.decode('utf-8')
+        if "<TALLYREQUEST>Import</TALLYREQUEST>" in body:
+            return self._import(body)
+        if "<TYPE>Collection</TYPE>" in body:
+            return self._export(body)
+        return _Response("<ENVELOPE></ENVELOPE>")
+
+    def _key(self, voucher):
+        return voucher.get('@REMOTEID')  # Tally matches an Alter on the GUID
+
+    def _import(self, body):
+        voucher = xmltodict.parse(body)['ENVELOPE']['BODY']['DATA']['TALLYMESSAGE']['VOUCHER']
+        if self._key(voucher) not in {self._key(v) for v in self.vouchers}:
+            return _Response("<RESPONSE><LINEERROR>Voucher not found</LINEERROR></RESPONSE>")
+        udfs = {key[4:-5]: tally_connector._text(value[key[:-5]])
+                for key, value in voucher.items() if key.startswith('UDF:') and key.endswith('.LIST')}
+        self.imports.append(udfs)
+        self.udfs.setdefault(self._key(voucher), {}).update(udfs)
+        return _Response("<RESPONSE><ALTERED>1</ALTERED></RESPONSE>")
+
+    def _export(self, body):
+        formula = re.search(r'NAME="EInvIsNotGenerated">NOT \(\$(\w+) = "(\w+)"\)<', body)
+        method, excluded = formula.group(1).upper(), formula.group(2)
+        pending = [v for v in self.vouchers if self.udfs.get(self._key(v), {}).get(method) != excluded]
+        return _Response(xmltodict.unparse(
+            {'ENVELOPE': {'BODY': {'DATA': {'COLLECTION': {'VOUCHER': pending} if pending else None}}}}))
+
+
+@pytest.fixture
+def fake_tally(monkeypatch):
+    tally = FakeTally(COLLECTION_EXPORT)
+    monkeypatch.setattr(tally_connector, 'SCHEDULER', TallyScheduler(tally, max_busy_ratio=1.0))
+    return tally
+
+
+GENERATED = {'status': 'Generated', 'irn': 'a' * 64, 'ack_no': 112010000000001, 'ack_date': '2025-04-01 10:00:00',
+             'qr_code': 'signed-qr', 'error_msg': ''}
+
+
+def test_writeback_sets_einvoice_udfs(fake_tally):
+    ok, msg = tally_connector.update_tally_voucher('abc-1', GENERATED)
+    assert ok, msg
+    assert fake_tally.imports[-1] == {
+        'VCHEINVOICEIRN': 'a' * 64, 'VCHEINVOICEACKNO': '112010000000001', 'VCHEINVOICEACKDATE': '2025-04-01 10:00:00',
+        'VCHEINVOICEQRCODE': 'signed-qr', 'VCHEINVOICESTATUS': 'Generated', 'VCHEINVOICEERROR': ''}
+
+    tally_connector.update_tally_voucher('abc-1', {'status': 'Failed', 'error_msg': 'Code 2150: <Duplicate> & more'})
+    assert fake_tally.imports[-1]['VCHEINVOICEERROR'] == 'Code 2150: <Duplicate> & more'
+
+
+def test_generated_voucher_is_not_fetched_again(fake_tally):
+    assert [i['guid'] for i in tally_connector.fetch_pending_invoices("01-04-2025", "30-04-2025")] == ['abc-1']
+
+    tally_connector.update_tally_voucher('abc-1', {'status': 'Failed', 'error_msg': 'IRP unavailable'})
+    assert len(tally_connector.fetch_pending_invoices("01-04-2025", "30-04-2025")) == 1  # Failed is retried
+
+    tally_connector.update_tally_voucher('abc-1', GENERATED)
+    assert tally_connector.fetch_pending_invoices("01-04-2025", "30-04-2025") == []
+
+
+def test_writeback_targets_voucher_guid_not_master_id(fake_tally):
+    ok, msg = tally_connector.update_tally_voucher('42', GENERATED)  # MasterID is not a REMOTEID
+    assert not ok and fake_tally.imports == []
+    assert tally_connector.update_tally_voucher('abc-1', GENERATED)[0]
+
+
+def test_company_name_is_escaped(monkeypatch):
+    monkeypatch.setattr(tally_connector, 'TALLY_COMPANY', "X & Co <Delhi>")
+    request = xmltodict.parse(tally_connector.get_pending_invoices_xml("01-04-2025", "30-04-2025"))
+    assert request['ENVELOPE']['BODY']['DESC']['STATICVARIABLES']['SVCURRENTCOMPANY'] == "X & Co <Delhi>"
+
+
+def test_fetch_reads_gstin_status_from_cache_only(fake_tally, monkeypatch):
+    def no_network(*args):
+        raise AssertionError("fetch must not call the IRP")
+
+    monkeypatch.setattr(gstin_lookup, '_fetch_from_irp', no_network)
+    gstin_lookup.clear_cache(disk=True)
+    invoices = tally_connector.fetch_pending_invoices('20250401', '20250430', priority=PRIORITY_INTERACTIVE)
+    assert [inv['gstin_status'] for inv in invoices] == ['Unknown']
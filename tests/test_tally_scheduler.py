@@ -0,0 +1,194 @@
+import threading
+import time
+
+import pytest
+
+from tally_scheduler import TallyScheduler, PRIORITY_INTERACTIVE, PRIORITY_FETCH, PRIORITY_WRITEBACK
+
+URL = "http://tally.test:9000"
+
+
+class FakeSession:
+    """Records request bodies in dispatch order; bodies listed in `hold` block until released."""
+
+    def __init__(self, hold=()):
+        self.calls = []
+        self.started = {body: threading.Event() for body in hold}
+        self.release = {body: threading.Event() for body in hold}
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.calls.append(data)
+        if data in self.release:
+            self.started[data].set()
+            self.release[data].wait(5)
+        return f"response:{data}"
+
+
+@pytest.fixture(autouse=True)
+def shared_dir(tmp_path, monkeypatch):
+    """Fresh endpoint state per test."""
+    monkeypatch.setenv("TALLY_SCHEDULER_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+def _blocked_scheduler(session):
+    """Scheduler whose dispatcher is busy with the held 'busy' request, so later submits queue up."""
+    scheduler = TallyScheduler(session, max_busy_ratio=1.0)  # No idle gaps between requests
+    busy = scheduler.submit(URL, "busy", {}, priority=PRIORITY_INTERACTIVE)
+    assert session.started["busy"].wait(5)
+    return scheduler, busy
+
+
+def test_dispatches_highest_priority_first():
+    session = FakeSession(hold=["busy"])
+    scheduler, busy = _blocked_scheduler(session)
+    futures = [scheduler.submit(URL, body, {}, priority=priority) for body, priority in
+               [("writeback", PRIORITY_WRITEBACK), ("fetch", PRIORITY_FETCH), ("interactive", PRIORITY_INTERACTIVE)]]
+
+    session.release["busy"].set()
+    assert [f.result(timeout=5) for f in futures] == ["response:writeback", "response:fetch", "response:interactive"]
+    assert session.calls == ["busy", "interactive", "fetch", "writeback"]
+
+
+def test_coalesced_duplicate_promotes_queued_request():
+    session = FakeSession(hold=["busy"])
+    scheduler, busy = _blocked_scheduler(session)
+    export = scheduler.submit(URL, "export", {}, priority=PRIORITY_WRITEBACK, coalesce=True)
+    fetch = scheduler.submit(URL, "fetch", {}, priority=PRIORITY_FETCH)
+    urgent = scheduler.submit(URL, "export", {}, priority=PRIORITY_INTERACTIVE, coalesce=True)
+
+    session.release["busy"].set()
+    assert urgent is export
+    assert fetch.result(timeout=5) == "response:fetch"
+    assert session.calls == ["busy", "export", "fetch"]
+
+
+def test_identical_requests_share_one_call():
+    session = FakeSession(hold=["busy"])
+    scheduler, busy = _blocked_scheduler(session)
+    futures = [scheduler.submit(URL, "export", {}, coalesce=True) for _ in range(3)]
+    plain = scheduler.submit(URL, "export", {})  # Not coalescable: sent separately
+
+    session.release["busy"].set()
+    assert {f.result(timeout=5) for f in futures} == {"response:export"}
+    plain.result(timeout=5)
+    assert session.calls == ["busy", "export", "export"]
+
+
+def test_post_gives_up_after_budget_and_cancels_queued_request():
+    session = FakeSession(hold=["busy"])
+    scheduler, busy = _blocked_scheduler(session)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler.post(URL, "late", {}, priority=PRIORITY_FETCH, budget=0.2, coalesce=True)
+    assert time.monotonic() - start < 1
+
+    session.release["busy"].set()
+    busy.result(timeout=5)
+    assert scheduler.post(URL, "after", {}, budget=5) == "response:after"
+    assert session.calls == ["busy", "after"]  # The abandoned request never reached Tally
+
+
+def test_post_returns_within_budget_while_request_runs():
+    session = FakeSession(hold=["slow"])
+    scheduler = TallyScheduler(session, max_busy_ratio=1.0)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        scheduler.post(URL, "slow", {}, priority=PRIORITY_INTERACTIVE, budget=0.2)
+    assert time.monotonic() - start < 1
+    assert session.started["slow"].is_set()
+
+    session.release["slow"].set()
+    assert scheduler.post(URL, "next", {}, priority=PRIORITY_INTERACTIVE, budget=5) == "response:next"
+
+
+def test_detached_waiter_keeps_shared_request_for_others():
+    session = FakeSession(hold=["busy"])
+    scheduler, busy = _blocked_scheduler(session)
+    keeper = scheduler.submit(URL, "export", {}, budget=5, coalesce=True)
+    with pytest.raises(TimeoutError):
+        scheduler.post(URL, "export", {}, budget=0.1, coalesce=True)
+
+    session.release["busy"].set()
+    assert keeper.result(timeout=5) == "response:export"
+    assert session.calls == ["busy", "export"]
+
+
+class TimedSession:
+    """Every request takes `delay` seconds; records (body, start, end) and the peak concurrency."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        start = time.monotonic()
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+            self.calls.append((data, start, time.monotonic()))
+        return f"response:{data}"
+
+
+def _gap_before(calls, body):
+    """Idle time between the previous call's end and the start of `body`."""
+    index = [c[0] for c in calls].index(body)
+    return calls[index][1] - calls[index - 1][2]
+
+
+def test_background_requests_leave_measured_idle_gap():
+    session = TimedSession(0.2)
+    # Busy ratio 0.5: after 0.2 s of background work Tally gets 0.2 s to itself
+    scheduler = TallyScheduler(session, max_busy_ratio=0.5)
+    first = scheduler.submit(URL, "fetch-1", {}, priority=PRIORITY_FETCH)
+    second = scheduler.submit(URL, "fetch-2", {}, priority=PRIORITY_FETCH)
+    second.result(timeout=5)
+    assert first.done()
+    assert _gap_before(session.calls, "fetch-2") >= 0.18
+    assert scheduler.avg_response_time == pytest.approx(0.2, abs=0.05)
+
+    # The gap only throttles background work: an interactive request goes straight in
+    scheduler.submit(URL, "fetch-3", {}, priority=PRIORITY_FETCH)
+    assert scheduler.post(URL, "interactive", {}, priority=PRIORITY_INTERACTIVE, budget=5) == "response:interactive"
+    assert [c[0] for c in session.calls][2] == "interactive"
+    assert _gap_before(session.calls, "interactive") < 0.1
+
+
+def test_idle_gap_is_capped():
+    session = TimedSession(0.2)
+    scheduler = TallyScheduler(session, max_busy_ratio=0.05, max_gap=0.3)  # Uncapped gap would be 3.8 s
+    futures = [scheduler.submit(URL, f"fetch-{n}", {}, priority=PRIORITY_FETCH) for n in (1, 2)]
+    futures[1].result(timeout=5)
+    assert 0.25 <= _gap_before(session.calls, "fetch-2") < 1.0
+
+
+def test_schedulers_in_different_processes_share_the_endpoint():
+    """Two schedulers with their own dispatchers (as in the GUI and a shard worker) on one Tally."""
+    session = TimedSession(0.1)
+    worker = TallyScheduler(session, max_busy_ratio=0.5)
+    gui = TallyScheduler(session, max_busy_ratio=0.5)
+
+    writebacks = [worker.submit(URL, f"writeback-{n}", {}, priority=PRIORITY_WRITEBACK) for n in (1, 2, 3)]
+    while not session.in_flight and not session.calls:
+        time.sleep(0.005)
+    # Queued in another process, yet it runs before the worker's remaining write-backs
+    assert gui.post(URL, "interactive", {}, priority=PRIORITY_INTERACTIVE, budget=5) == "response:interactive"
+    gui_fetch = gui.submit(URL, "gui-fetch", {}, priority=PRIORITY_FETCH)
+    for future in writebacks + [gui_fetch]:
+        future.result(timeout=5)
+
+    # Priorities hold across processes: the GUI's fetch also overtakes the worker's write-backs
+    assert [c[0] for c in session.calls] == ["writeback-1", "interactive", "gui-fetch", "writeback-2", "writeback-3"]
+    assert session.max_in_flight == 1  # Never two requests at Tally at once
+    # The idle gap is shared: each background request waits out the previous background request's gap
+    background = [c for c in session.calls if c[0] != "interactive"]
+    for previous, current in zip(background, background[1:]):
+        assert current[1] - previous[2] >= 0.08
@@ -18,10 +18,11 @@ def is_valid_date_format(date_str):
      pattern = r"^\d{2}/\d{2}/\d{4}$"
      return bool(re.match(pattern, date_str))
 
-def validate_invoice_data_for_irn(invoice_json_dict):
+def validate_invoice_data_for_irn(invoice_json_dict, buyer_gstin_info=None):
     """
     Performs pre-validation checks before sending to IRP.
     Checks mandatory fields and basic formats in the *final JSON*.
+    If buyer_gstin_info (a gstin_lookup cache entry) is given, cancelled/unknown buyers are rejected too.
     Returns True if valid, or a list of error strings if invalid.
     """
     errors = []
@@ -42,6 +43,8 @@ def validate_invoice_data_for_irn(invoice_json_dict):
     if not is_valid_gstin(buyer.get("Gstin")): errors.append("Invalid BuyerDtls.Gstin")
     if not buyer.get("LglNm"): errors.append("Missing BuyerDtls.LglNm")
     if not buyer.get("Pos"): errors.append("Missing BuyerDtls.Pos (Place of Supply State Code)")
+    if buyer_gstin_info is not None and not buyer_gstin_info.get("valid"):
+        errors.append(f"BuyerDtls.Gstin rejected by IRP master: {buyer_gstin_info.get('reason') or 'inactive'}")
     # Add more checks: Addr1, Loc, Pin, Stcd
 
     # --- ItemList ---